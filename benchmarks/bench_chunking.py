@@ -0,0 +1,149 @@
+"""
+Chunking benchmark: langchain's character splitter against TokenChunker, and the cleanup of pdf results.
+
+The pages of the pdf files (or of a generated pdf corpus) are read once, then split by both splitters.
+For every splitter the result reports pages/sec, the number of chunks and their length in tokens
+of the embedding model, including the share of chunks longer than the model's limit, which the model truncates.
+The old per-character str.replace cleanup of _format_response is compared with PDF_CLEANUP_TABLE on the chunks.
+
+Run from the repository root:
+    python benchmarks/bench_chunking.py --pdf big_1.pdf big_2.pdf --char-chunk-size 300 --token-chunk-size 128
+    python benchmarks/bench_chunking.py --documents 5 --pages 200
+
+The result is one json object.
+"""
+import argparse
+import json
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def replace_cleanup(documents):
+    """
+    The cleanup of pdf results before PDF_CLEANUP_TABLE, kept as the baseline.
+    """
+    vector_db_response = ''
+    for doc in documents:
+        for i in doc:
+            if i in string.punctuation or i in "«»":
+                doc = doc.replace(i, '').replace("\n", "")
+        vector_db_response += doc.capitalize() + ". "
+    return vector_db_response
+
+
+def token_lengths(tokenizer, chunks):
+    if not chunks:
+        return np.zeros(0, dtype=np.int64)
+    return np.array([len(ids) for ids in tokenizer(chunks, add_special_tokens=True, verbose=False)['input_ids']])
+
+
+def split_pages(text_splitter, pages, repeats):
+    """
+    Returns: (list, float) - chunks of all pages and the best time of `repeats` runs in seconds
+    """
+    from lib.documents import iter_chunk_batches
+
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        chunks = [text for batch in iter_chunk_batches(pages, text_splitter, {}, 1024) for text, _ in batch]
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return chunks, best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdf', nargs='*', default=None, help='pdf files, a corpus is generated if not set')
+    parser.add_argument('--documents', type=int, default=3, help='number of generated documents')
+    parser.add_argument('--pages', type=int, default=100, help='pages per generated document')
+    parser.add_argument('--words-per-page', type=int, default=500)
+    parser.add_argument('--char-chunk-size', type=int, default=300)
+    parser.add_argument('--char-chunk-overlap', type=int, default=100)
+    parser.add_argument('--token-chunk-size', type=int, default=128)
+    parser.add_argument('--token-chunk-overlap', type=int, default=32)
+    parser.add_argument('--page-batch-size', type=int, default=16)
+    parser.add_argument('--tokenizer', default="intfloat/multilingual-e5-small")
+    parser.add_argument('--repeats', type=int, default=3, help='runs of every splitter, the best time is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='file for the json result, stdout if not set')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, str(REPO_DIR))
+    from lib.documents import iter_pages, make_text_splitter
+    from lib.token_chunker import load_tokenizer
+    from lib.vector_db_setup import PDF_CLEANUP_TABLE
+    from benchmarks.synthetic_corpus import generate_corpus
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = args.pdf or generate_corpus(work_dir, args.documents, args.pages, args.words_per_page, 'pdf', args.seed)
+        started = time.perf_counter()
+        pages = [page for path in paths for page in iter_pages(path, file_type='pdf')]
+        read_seconds = time.perf_counter() - started
+
+    tokenizer = load_tokenizer(args.tokenizer)
+    limit = tokenizer.model_max_length
+    splitters = {
+        'characters': make_text_splitter(args.char_chunk_size, args.char_chunk_overlap),
+        'tokens': make_text_splitter(
+            args.token_chunk_size, args.token_chunk_overlap,
+            unit='tokens', tokenizer_name=args.tokenizer, page_batch_size=args.page_batch_size
+        )
+    }
+    result = {
+        'files': len(paths),
+        'pages': len(pages),
+        'characters': sum(len(text) for _, text in pages),
+        'read_seconds': round(read_seconds, 3),
+        'model_max_length': limit,
+        'splitters': {}
+    }
+    chunks_by_splitter = {}
+    for name, text_splitter in splitters.items():
+        chunks, seconds = split_pages(text_splitter, pages, args.repeats)
+        chunks_by_splitter[name] = chunks
+        lengths = token_lengths(tokenizer, chunks)
+        result['splitters'][name] = {
+            'seconds': round(seconds, 3),
+            'pages_per_second': round(len(pages) / seconds, 1),
+            'chunks': len(chunks),
+            'mean_tokens': round(float(lengths.mean()), 1) if len(lengths) else None,
+            'max_tokens': int(lengths.max()) if len(lengths) else None,
+            'truncated_share': round(float((lengths > limit).mean()), 4) if len(lengths) else None
+        }
+
+    documents = chunks_by_splitter['characters'] # фрагменты того же размера, что и в ответах сейчас
+    started = time.perf_counter()
+    old_response = replace_cleanup(documents)
+    replace_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    new_response = "".join(doc.translate(PDF_CLEANUP_TABLE).capitalize() + ". " for doc in documents)
+    translate_seconds = time.perf_counter() - started
+    result['cleanup'] = {
+        'chunks': len(documents),
+        'replace_seconds': round(replace_seconds, 4),
+        'translate_seconds': round(translate_seconds, 4),
+        'speedup': round(replace_seconds / translate_seconds, 1) if translate_seconds else None,
+        # Старая очистка удаляла переносы строк только во фрагментах со знаками препинания
+        'same_output': old_response == new_response
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Recall@k and memory of the compact vector modes of lib.local_vectorstore.
+
+The vectors of an existing local collection (or synthetic embedding-like vectors) are copied
+into a temporary collection for every mode, and its search is compared with the exact float32 search.
+
+Run from the repository root:
+    python benchmarks/bench_compact.py --store streamlit_app/vectorstore --collection my_collection --k 10
+    python benchmarks/bench_compact.py --synthetic 20000 --modes float16 int8 int8:128 float32:96
+
+A mode is dtype[:pca_dim]. The result is one json object with a recall report per mode.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def synthetic_vectors(n, dim=384, rank=64, seed=0):
+    """
+    Normalized vectors with a decaying spectrum and a common offset, like sentence embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(rank, dim))
+    vectors = (rng.normal(size=(n, rank)) * np.linspace(3, 0.3, rank)) @ basis + rng.normal(size=(n, dim)) * 0.5 + 5
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def parse_mode(mode):
+    dtype, _, pca_dim = mode.partition(':')
+    metadata = {'vectors:dtype': dtype}
+    if pca_dim:
+        metadata['vectors:pca_dim'] = int(pca_dim)
+    return metadata
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', default=None, help='directory of the local vector store')
+    parser.add_argument('--collection', default=None, help='collection of the store to evaluate')
+    parser.add_argument('--synthetic', type=int, default=20000, help='number of synthetic vectors if --store is not set')
+    parser.add_argument('--modes', nargs='+', default=['float16', 'int8', 'int8:128', 'float32:96'])
+    parser.add_argument('--queries', type=int, default=200, help='stored vectors used as queries')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    parser.add_argument('--hnsw-threshold', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='file for the json result, stdout if not set')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, str(REPO_DIR))
+    from lib.local_vectorstore import LocalClient
+
+    if args.store is not None:
+        source = LocalClient(args.store).get_collection(args.collection)
+        vectors = np.asarray(source.get(include=['embeddings'])['embeddings'], dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.synthetic, seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+    # Запросы - слегка зашумленные векторы коллекции, чтобы ближайший сосед не совпадал с запросом
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = queries + rng.normal(size=queries.shape) * 0.02
+
+    result = {'vectors': len(vectors), 'dim': int(vectors.shape[1]), 'k': args.k, 'modes': {}}
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as directory:
+            metadata = {**parse_mode(mode), 'vectors:rescore_factor': args.rescore_factor, 'vectors:fit_rows': min(1000, len(vectors))}
+            collection = LocalClient(directory, hnsw_threshold=args.hnsw_threshold).get_or_create_collection('bench', metadata=metadata)
+            for start in range(0, len(vectors), 1000):
+                block = vectors[start:start + 1000]
+                collection.upsert(ids=[str(i) for i in range(start, start + len(block))], embeddings=block)
+            started = time.perf_counter()
+            report = collection.recall_at_k(queries, k=args.k)
+            report['seconds'] = round(time.perf_counter() - started, 3)
+            report['memory_ratio'] = round(report['full_bytes'] / report['compact_bytes'], 2)
+            result['modes'][mode] = report
+            collection.close()
+
+    output = json.dumps(result, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Throughput and latency of micro-batched embedding (lib.micro_batcher) against encoding every request on its own.
+
+Concurrent clients send small encode requests, like chat sessions and ingestion jobs sharing one model.
+In the per-request mode they take turns on the model, in the batched mode their requests are merged
+by MicroBatcher. With --url the requests go to a running lib.embedding_server instead.
+
+Run from the repository root:
+    python benchmarks/bench_embedding_server.py --clients 32 --requests 20 --texts 1
+    python benchmarks/bench_embedding_server.py --url http://localhost:8090 --clients 64
+
+The result is one json object with texts/sec and p50/p95/p99 request latency per mode.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_clients(encode, clients, requests, texts):
+    """
+    Runs the clients in threads, every client encodes `requests` requests of `texts` texts one after another.
+
+    Returns: dict - texts/sec and request latency summary
+    """
+    from benchmarks.bench_rag import latency_summary
+
+    latencies = [[] for _ in range(clients)]
+
+    def client(number):
+        for request in range(requests):
+            batch = [f"query: вопрос {number}-{request}-{i} о содержании загруженного документа" for i in range(texts)]
+            started = time.perf_counter()
+            encode(batch)
+            latencies[number].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(client, range(clients)))
+    seconds = time.perf_counter() - started
+    return {
+        'texts_per_sec': round(clients * requests * texts / seconds, 1),
+        'seconds': round(seconds, 3),
+        'latency': latency_summary([value for client_latencies in latencies for value in client_latencies])
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--texts', type=int, default=1, help='texts per request')
+    parser.add_argument('--model', default="intfloat/multilingual-e5-small")
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--url', default=None, help='address of a running lib.embedding_server')
+    parser.add_argument('--output', default=None, help='file for the json result, stdout if not set')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, str(REPO_DIR))
+    from lib.embedding_models import get_embedding_model
+    from lib.micro_batcher import MicroBatcher
+
+    result = {'clients': args.clients, 'requests': args.requests, 'texts': args.texts, 'modes': {}}
+    if args.url is not None:
+        remote = get_embedding_model(args.model, url=args.url)
+        remote.warm_up()
+        result['modes']['server'] = run_clients(remote.encode, args.clients, args.requests, args.texts)
+        result['modes']['server']['stats'] = remote.load().get('/stats').json()
+    else:
+        model = get_embedding_model(args.model)
+        model.warm_up()
+        lock = threading.Lock()
+
+        def encode_alone(texts):
+            with lock:
+                return model.encode(texts)
+
+        result['modes']['per_request'] = run_clients(encode_alone, args.clients, args.requests, args.texts)
+        batcher = MicroBatcher(model.encode, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+        result['modes']['batched'] = run_clients(lambda texts: batcher.submit(texts).result(), args.clients, args.requests, args.texts)
+        result['modes']['batched']['stats'] = batcher.stats()
+        batcher.stop()
+
+    output = json.dumps(result, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Import time benchmark of lib.vector_db_setup.
+
+Every run imports the module in a fresh interpreter with -X importtime, from streamlit_app like the app does.
+Then, in the same interpreter, it times the first get_config() and, with --with-model, the first warm_up_embeddings().
+
+Run from the repository root:
+    python benchmarks/bench_import.py --runs 5 --output import.json
+
+The result is one json object: min/median/max of the import in milliseconds
+and the modules with the largest cumulative import time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+APP_DIR = REPO_DIR / 'streamlit_app'
+
+CHILD_CODE = """
+import json, sys, time
+sys.path.insert(0, {repo_dir!r})
+started = time.perf_counter()
+from lib import vector_db_setup
+timings = {{'import_seconds': time.perf_counter() - started}}
+started = time.perf_counter()
+vector_db_setup.get_config()
+timings['config_seconds'] = time.perf_counter() - started
+if {with_model!r}:
+    started = time.perf_counter()
+    vector_db_setup.warm_up_embeddings()
+    timings['model_seconds'] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Returns {module: cumulative microseconds} from the output of -X importtime.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, _, cumulative, module = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        modules[module] = max(modules.get(module, 0), int(cumulative))
+    return modules
+
+
+def summary(values):
+    milliseconds = [value * 1000 for value in values]
+    return {'min_ms': round(min(milliseconds), 1), 'median_ms': round(statistics.median(milliseconds), 1), 'max_ms': round(max(milliseconds), 1)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='number of the slowest modules in the result')
+    parser.add_argument('--with-model', action='store_true', help='also time loading and warming up the embedding model')
+    parser.add_argument('--output', default=None, help='file for the json result, stdout if not set')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    code = CHILD_CODE.format(repo_dir=str(REPO_DIR), with_model=args.with_model)
+    runs = []
+    modules = {}
+    for _ in range(args.runs):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=APP_DIR,
+            env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        for module, cumulative in parse_importtime(completed.stderr).items():
+            modules.setdefault(module, []).append(cumulative)
+
+    slowest = sorted(((statistics.median(values), module) for module, values in modules.items()), reverse=True)[:args.top]
+    result = {
+        'runs': args.runs,
+        'import': summary([run['import_seconds'] for run in runs]),
+        'first_get_config': summary([run['config_seconds'] for run in runs]),
+        'slowest_modules_ms': {module: round(value / 1000, 1) for value, module in slowest}
+    }
+    if args.with_model:
+        result['first_warm_up'] = summary([run['model_seconds'] for run in runs])
+
+    output = json.dumps(result, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Ingestion and query benchmark of lib.vector_db_setup against an in-process chromadb
+(EphemeralClient or PersistentClient) instead of the server from docker-compose.
+
+Run from the repository root:
+    python benchmarks/bench_rag.py --documents 20 --pages 30 --queries 500 --output bench.json
+
+The result is one json object: chunks/sec of get_texts and ingest_folder, embeddings/sec of the model,
+peak RSS and p50/p95/p99 latency of single and batched queries.
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+APP_DIR = REPO_DIR / 'streamlit_app'
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile, q in [0, 100].
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        'count': len(milliseconds),
+        'p50_ms': percentile(milliseconds, 50),
+        'p95_ms': percentile(milliseconds, 95),
+        'p99_ms': percentile(milliseconds, 99),
+        'max_ms': max(milliseconds) if milliseconds else None
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=10, help='number of generated documents')
+    parser.add_argument('--pages', type=int, default=20, help='pages per document')
+    parser.add_argument('--words-per-page', type=int, default=400)
+    parser.add_argument('--format', choices=['txt', 'pdf', 'both'], default='both')
+    parser.add_argument('--chunk-size', type=int, default=300)
+    parser.add_argument('--chunk-overlap', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help='parsing processes of ingest_folder')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--n-results', type=int, default=2)
+    parser.add_argument('--mode', choices=['vector', 'hybrid'], default='vector')
+    parser.add_argument('--embedding-sample', type=int, default=512, help='chunks embedded to measure embeddings/sec')
+    parser.add_argument('--client', choices=['ephemeral', 'persistent'], default='ephemeral')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='file for the json result, stdout if not set')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output_path = Path(args.output).resolve() if args.output else None
+    sys.path.insert(0, str(REPO_DIR))
+    os.chdir(APP_DIR) # lib.vector_db_setup читает ./config.yaml и пишет в logs/
+
+    import chromadb
+    from lib import vector_db_setup
+    from benchmarks.synthetic_corpus import generate_corpus, sample_questions
+
+    vector_db_setup.get_config().setdefault('embedding_cache', {})['enabled'] = False # Замеряется модель, а не кэш эмбеддингов
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        vector_db_setup.config.setdefault('bm25', {})['path'] = str(work_dir / 'bm25') # Индексы бенчмарка не попадают в рабочие
+        if args.client == 'persistent':
+            client = chromadb.PersistentClient(path=str(work_dir / 'chroma'))
+        else:
+            client = chromadb.EphemeralClient()
+
+        corpus_dir = work_dir / 'corpus'
+        paths = generate_corpus(corpus_dir, args.documents, args.pages, args.words_per_page, args.format, args.seed)
+        corpus_bytes = sum(path.stat().st_size for path in paths)
+
+        started = time.perf_counter()
+        vector_db_setup.warm_up_embeddings()
+        model_load_seconds = time.perf_counter() - started
+
+        # get_texts: потоковая загрузка одного документа
+        started = time.perf_counter()
+        report = vector_db_setup.get_texts(
+            str(paths[0]),
+            collection_name='bench_single',
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            batch_size=args.batch_size,
+            client=client
+        )
+        single_seconds = time.perf_counter() - started
+        single_chunks = report['added'] + report['unchanged']
+
+        # ingest_folder: весь корпус в одну коллекцию
+        started = time.perf_counter()
+        folder_report = vector_db_setup.ingest_folder(
+            collection_name='bench_corpus',
+            folder=corpus_dir,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            manifest_path=work_dir / 'manifest.json',
+            client=client
+        )
+        folder_seconds = time.perf_counter() - started
+        collection = client.get_collection('bench_corpus')
+        corpus_chunks = collection.count()
+
+        sample = collection.get(limit=args.embedding_sample, include=['documents'])['documents']
+        started = time.perf_counter()
+        vector_db_setup.embed_documents(sample)
+        embedding_seconds = time.perf_counter() - started
+
+        questions = sample_questions(paths, args.queries, seed=args.seed)
+        latencies = []
+        for question in questions:
+            # Без кэшей: замеряется эмбеддинг вопроса и поиск
+            vector_db_setup.query_cache.embeddings.clear()
+            vector_db_setup.query_cache.results.clear()
+            started = time.perf_counter()
+            vector_db_setup.vectorstore_query(collection, 'txt', question, args.n_results, mode=args.mode)
+            latencies.append(time.perf_counter() - started)
+
+        vector_db_setup.query_cache.embeddings.clear()
+        vector_db_setup.query_cache.results.clear()
+        started = time.perf_counter()
+        vector_db_setup.vectorstore_query_batch(collection, 'txt', questions, args.n_results, mode=args.mode)
+        batch_seconds = time.perf_counter() - started
+
+    result = {
+        'parameters': vars(args),
+        'corpus': {'documents': len(paths), 'bytes': corpus_bytes, 'chunks': corpus_chunks},
+        'model_load_seconds': round(model_load_seconds, 3),
+        'get_texts': {
+            'chunks': single_chunks,
+            'seconds': round(single_seconds, 3),
+            'chunks_per_second': round(single_chunks / single_seconds, 1)
+        },
+        'ingest_folder': {
+            'report': folder_report,
+            'seconds': round(folder_seconds, 3),
+            'chunks_per_second': round(corpus_chunks / folder_seconds, 1)
+        },
+        'embeddings_per_second': round(len(sample) / embedding_seconds, 1) if sample else None,
+        'query': latency_summary(latencies),
+        'query_batch': {
+            'questions': len(questions),
+            'seconds': round(batch_seconds, 3),
+            'questions_per_second': round(len(questions) / batch_seconds, 1) if questions else None
+        },
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+    output = json.dumps(result, indent=2, default=str)
+    if output_path is not None:
+        output_path.write_text(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
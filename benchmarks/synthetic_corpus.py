@@ -0,0 +1,114 @@
+import random
+from pathlib import Path
+
+
+WORDS = (
+    "pump valve motor sensor filter pressure flow voltage current manual service warranty "
+    "installation maintenance inspection replace check connect cable housing bearing seal "
+    "temperature level alarm controller panel display button switch fuse relay circuit "
+    "operator safety warning caution note procedure step model serial number part unit "
+    "system device module interface network power supply output input signal range value"
+).split()
+
+
+def make_page(rng, words_per_page, line_width=90):
+    """
+    Returns the lines of one page of random text with a few part numbers in it.
+    """
+    words = [rng.choice(WORDS) for _ in range(words_per_page)]
+    for _ in range(max(1, words_per_page // 200)):
+        words[rng.randrange(len(words))] = f"XK-{rng.randrange(10000):04d}"
+    lines, line = [], ""
+    for word in words:
+        if len(line) + len(word) + 1 > line_width:
+            lines.append(line)
+            line = ""
+        line = f"{line} {word}" if line else word
+    lines.append(line)
+    return lines
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages):
+    """
+    Writes a minimal PDF with one Helvetica text block per page, enough for pdfminer.
+
+    path: str - path of the file
+    pages: list - lines of every page
+    """
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(pages)} >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    for page_id, lines in zip(page_ids, pages):
+        content = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects[page_id] = f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        objects[page_id + 1] = f"<< /Length {len(content)} >>\nstream\n{content}\nendstream"
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(data)
+        data += f"{number} 0 obj\n{objects[number]}\nendobj\n".encode('latin-1')
+    xref_position = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    data += "".join(f"{offsets[number]:010d} 00000 n \n" for number in sorted(objects)).encode('latin-1')
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode('latin-1')
+    Path(path).write_bytes(bytes(data))
+
+
+def generate_corpus(directory, n_documents, pages_per_document, words_per_page, file_format='txt', seed=0):
+    """
+    Generates a corpus of random documents.
+
+    directory: str - where to write the files
+    n_documents: int - the number of documents
+    pages_per_document: int - the number of pages in a document
+    words_per_page: int - the number of words on a page
+    file_format: str, default='txt' - 'txt', 'pdf' or 'both' (formats alternate)
+    seed: int, default=0 - seed of the random generator
+
+    Returns: list - paths of the generated files
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n_documents):
+        extension = file_format if file_format != 'both' else ('txt', 'pdf')[i % 2]
+        pages = [make_page(rng, words_per_page) for _ in range(pages_per_document)]
+        path = directory / f"document_{i:04d}.{extension}"
+        if extension == 'pdf':
+            write_pdf(path, pages)
+        else:
+            path.write_text("\n\n".join("\n".join(lines) for lines in pages), encoding='utf-8')
+        paths.append(path)
+    return paths
+
+
+def sample_questions(paths, n_questions, seed=0, words=8, max_documents=5):
+    """
+    Builds questions from random word windows of the generated documents.
+
+    paths: list - paths returned by generate_corpus
+    n_questions: int - the number of questions
+    seed: int, default=0 - seed of the random generator
+    words: int, default=8 - the number of words in a question
+    max_documents: int, default=5 - the number of documents the windows are taken from
+    """
+    from lib.documents import iter_pages
+
+    rng = random.Random(seed)
+    texts = [text.split() for path in paths[:max_documents] for _, text in iter_pages(path)]
+    texts = [text for text in texts if text]
+    questions = []
+    for _ in range(n_questions):
+        text = rng.choice(texts)
+        start = rng.randrange(max(1, len(text) - words))
+        questions.append(" ".join(text[start:start + words]))
+    return questions
@@ -0,0 +1,205 @@
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Splits the text into lowercase words, the same way for chunks and questions.
+    """
+    return [token.casefold() for token in TOKEN_RE.findall(text)]
+
+
+class BM25Index:
+    """
+    Inverted index of the chunks of one collection with BM25 ranking.
+
+    Every term keeps a posting list {slot: term frequency}, so a query reads only
+    the posting lists of its own terms and its cost doesn't grow with the collection.
+    Every slot keeps the list of its own terms, so removing a chunk touches only those posting lists.
+    Terms found in more than max_df_ratio of the chunks are skipped at query time
+    when the question has rarer terms, they are too common to change the ranking.
+
+    k1: float, default=1.5 - term frequency saturation
+    b: float, default=0.75 - length normalization
+    max_df_ratio: float, default=0.5 - share of chunks above which a term is treated as a stop word
+    """
+
+    def __init__(self, k1=1.5, b=0.75, max_df_ratio=0.5):
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock() # сохранения одного индекса идут по очереди, последнее - самое свежее
+        self._ids = [] # slot -> id чанка, None для удаленных
+        self._lengths = []
+        self._terms = [] # slot -> термины чанка, чтобы удаление не перебирало весь словарь
+        self._slots = {}
+        self._postings = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._slots
+
+    def add_many(self, ids, texts):
+        """
+        Adds chunks to the index, chunks which are already indexed are skipped.
+
+        ids: list - ids of the chunks in the collection
+        texts: list - texts of the chunks
+        """
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self._slots:
+                    continue
+                tokens = tokenize(text)
+                slot = len(self._ids)
+                self._ids.append(chunk_id)
+                self._lengths.append(len(tokens))
+                self._slots[chunk_id] = slot
+                self._total_length += len(tokens)
+                counts = Counter(tokens)
+                self._terms.append(list(counts))
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[slot] = tf
+
+    def remove_many(self, ids):
+        """
+        Removes chunks from the index, only the posting lists of their own terms are visited.
+
+        ids: list - ids of the chunks to remove
+        """
+        with self._lock:
+            for chunk_id in ids:
+                slot = self._slots.pop(chunk_id, None)
+                if slot is None:
+                    continue
+                self._ids[slot] = None
+                self._total_length -= self._lengths[slot]
+                for term in self._terms[slot]:
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        continue
+                    postings.pop(slot, None)
+                    if not postings:
+                        del self._postings[term]
+                self._terms[slot] = []
+
+    def search(self, query, k):
+        """
+        Returns up to k (chunk id, score) pairs, best first.
+
+        query: str - the question
+        k: int - the number of results
+        """
+        with self._lock:
+            n_docs = len(self._slots)
+            if n_docs == 0:
+                return []
+            terms = [term for term in set(tokenize(query)) if term in self._postings]
+            rare_terms = [term for term in terms if len(self._postings[term]) <= self.max_df_ratio * n_docs]
+            if rare_terms:
+                terms = rare_terms
+
+            average_length = self._total_length / n_docs
+            scores = {}
+            for term in terms:
+                postings = self._postings[term]
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for slot, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[slot] / average_length)
+                    scores[slot] = scores.get(slot, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self._ids[slot], score) for slot, score in best]
+
+    def save(self, path):
+        """
+        Saves the index to a gzipped json file, removed slots are dropped.
+        The file is written under a unique temporary name and replaced atomically,
+        so concurrent saves of the same path don't break each other.
+
+        path: str - path of the file
+        """
+        with self._save_lock:
+            self._save(path)
+
+    def _save(self, path):
+        with self._lock:
+            alive = [slot for slot, chunk_id in enumerate(self._ids) if chunk_id is not None]
+            new_slot = {slot: i for i, slot in enumerate(alive)}
+            data = {
+                'k1': self.k1,
+                'b': self.b,
+                'max_df_ratio': self.max_df_ratio,
+                'ids': [self._ids[slot] for slot in alive],
+                'lengths': [self._lengths[slot] for slot in alive],
+                # Постинги хранятся двумя плоскими списками: слоты и частоты
+                'postings': {
+                    term: [[new_slot[slot] for slot in postings], list(postings.values())]
+                    for term, postings in self._postings.items()
+                }
+            }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the index saved with save(), returns an empty index if the file doesn't exist.
+
+        path: str - path of the file
+        """
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(k1=data['k1'], b=data['b'], max_df_ratio=data['max_df_ratio'])
+        index._ids = data['ids']
+        index._lengths = data['lengths']
+        index._slots = {chunk_id: slot for slot, chunk_id in enumerate(index._ids)}
+        index._total_length = sum(index._lengths)
+        index._postings = {term: dict(zip(slots, tfs)) for term, (slots, tfs) in data['postings'].items()}
+        index._terms = [[] for _ in index._ids]
+        for term, postings in index._postings.items():
+            for slot in postings:
+                index._terms[slot].append(term)
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several rankings of ids: every id gets the sum of 1 / (k + rank) over the rankings.
+
+    rankings: list - lists of ids, best first
+    k: int, default=60 - smoothing constant, larger values flatten the difference between ranks
+
+    Returns: list - ids ordered by the fused score
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,94 @@
+import threading
+import time
+import logging
+
+
+_client = None
+_client_lock = threading.Lock()
+_last_heartbeat = 0.0
+
+
+def with_retries(func, *args, max_retries=3, base_delay=0.5, **kwargs):
+    """
+    This function is used to call chromadb with retries.
+    Failed calls are repeated with exponential backoff: base_delay, 2*base_delay, 4*base_delay, ...
+
+    func: callable - the call to make
+    max_retries: int, default=3 - the number of attempts before the error is raised
+    base_delay: float, default=0.5 - the delay before the second attempt in seconds
+    """
+    for attempt in range(1, max_retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * 2 ** (attempt - 1)
+            logging.warning(f"Ошибка при запросе к CHROMADB {getattr(func, '__name__', func)} (попытка {attempt}/{max_retries}): {e}. Повтор через {delay} с")
+            time.sleep(delay)
+
+
+def create_chroma_client(server_config, timeout=None):
+    """
+    This function is used to create a new chroma http client.
+    The client keeps its http connections alive, so it should be created once and reused.
+
+    server_config: dict - chromadb.server_config section of config.yaml
+    timeout: float, default=None - timeout of every request in seconds, no timeout if None
+    """
+    import chromadb # Импорт chromadb занимает секунды, поэтому он делается при создании клиента
+    from chromadb.config import Settings
+
+    client = chromadb.HttpClient(
+        settings=Settings(
+            allow_reset=server_config['allow_reset'],
+            chroma_api_impl=server_config['chroma_api_impl'],
+            chroma_server_host=server_config['chroma_server_host'],
+            chroma_server_http_port=server_config['chroma_server_http_port'],
+            anonymized_telemetry=server_config['anonymized_telemetry']
+            )
+        )
+    # У HttpClient нет настройки таймаута, он задается у сессии httpx внутри клиента
+    session = getattr(getattr(client, '_server', None), '_session', None)
+    if timeout is not None and session is not None and hasattr(session, 'timeout'):
+        session.timeout = timeout
+    return client
+
+
+def get_shared_chroma_client(server_config, timeout=None, heartbeat_interval=30, max_retries=3):
+    """
+    This function is used to get the chroma client shared by the whole process.
+    The server is checked with a heartbeat at most once per heartbeat_interval,
+    an unhealthy client is replaced with a new one.
+
+    server_config: dict - chromadb.server_config section of config.yaml
+    timeout: float, default=None - timeout of every request in seconds
+    heartbeat_interval: float, default=30 - seconds between health checks
+    max_retries: int, default=3 - the number of attempts to connect
+    """
+    global _client, _last_heartbeat
+    with _client_lock:
+        if _client is not None and time.monotonic() - _last_heartbeat < heartbeat_interval:
+            return _client
+        if _client is not None:
+            try:
+                _client.heartbeat()
+                _last_heartbeat = time.monotonic()
+                return _client
+            except Exception as e:
+                logging.warning(f"CHROMADB не отвечает на heartbeat: {e}, клиент будет создан заново")
+                _client = None
+
+        client = with_retries(create_chroma_client, server_config, timeout, max_retries=max_retries)
+        with_retries(client.heartbeat, max_retries=max_retries)
+        _client, _last_heartbeat = client, time.monotonic()
+        return _client
+
+
+def reset_shared_chroma_client():
+    """
+    This function is used to drop the shared client, the next call creates a new one.
+    """
+    global _client
+    with _client_lock:
+        _client = None
@@ -0,0 +1,156 @@
+import hashlib
+import io
+from pathlib import Path
+
+
+SUPPORTED_FILE_TYPES = ('pdf', 'txt')
+
+
+def iter_pages(source, file_type=None, text_page_size=10000):
+    """
+    This function is used to read a document page by page.
+    Only the current page is kept in memory.
+
+    source: str, Path, bytes or file-like object - path to the file or its content
+    file_type: str, default=None - 'pdf' or 'txt', taken from the file's extension if None
+    text_page_size: int, default=10000 - approximate number of characters in a page of a txt file
+
+    Yields: (int, str) - the number of the page starting from 1 and its text
+    """
+    if file_type is None:
+        file_type = Path(str(getattr(source, 'name', source))).suffix.lstrip('.')
+    file_type = file_type.lower()
+    if file_type not in SUPPORTED_FILE_TYPES:
+        raise ValueError(f"Неподдерживаемый тип файла: {file_type}")
+
+    if isinstance(source, (str, Path)):
+        stream = open(source, 'rb')
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(source)
+    else:
+        stream = source
+        stream.seek(0)
+
+    try:
+        if file_type == 'pdf':
+            from pdfminer.high_level import extract_pages
+            from pdfminer.layout import LTTextContainer
+            for page_number, layout in enumerate(extract_pages(stream), start=1):
+                yield page_number, "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+        else:
+            text_stream = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+            try:
+                page_number, lines, size = 1, [], 0
+                for line in text_stream:
+                    lines.append(line)
+                    size += len(line)
+                    if size >= text_page_size:
+                        yield page_number, "".join(lines)
+                        page_number, lines, size = page_number + 1, [], 0
+                if lines:
+                    yield page_number, "".join(lines)
+            finally:
+                text_stream.detach() # Буфер закрывает тот, кто его передал
+    finally:
+        if isinstance(source, (str, Path)):
+            stream.close()
+
+
+def make_text_splitter(chunk_size, chunk_overlap, unit='characters', tokenizer_name=None, page_batch_size=16):
+    """
+    This function is used to create the splitter of the pages into chunks.
+    langchain and transformers are imported here and not at the module level, they take a few seconds to import.
+
+    chunk_size: int - the size of the chunks
+    chunk_overlap: int - the overlap between the chunks
+    unit: str, default='characters' - 'characters' (langchain RecursiveCharacterTextSplitter) or 'tokens' (TokenChunker)
+    tokenizer_name: str, default=None - model whose fast tokenizer counts the tokens, required for 'tokens'
+    page_batch_size: int, default=16 - the number of pages tokenized at once in 'tokens' mode
+    """
+    if unit == 'tokens':
+        from lib.token_chunker import TokenChunker, load_tokenizer
+        return TokenChunker(load_tokenizer(tokenizer_name), chunk_size, chunk_overlap, page_batch_size=page_batch_size)
+    if unit != 'characters':
+        raise ValueError(f"Неизвестная единица размера чанков: {unit}")
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len
+    )
+
+
+def iter_chunk_batches(pages, text_splitter, metadata, batch_size):
+    """
+    This function is used to split pages into chunks and group the chunks into batches.
+    A splitter with split_texts() (TokenChunker) gets page_batch_size pages at once.
+
+    pages: iterable - (page number, text) pairs from iter_pages
+    text_splitter: TextSplitter - splitter used for every page
+    metadata: dict - metadata added to every chunk
+    batch_size: int - the number of chunks in a batch
+
+    Yields: list - (text, metadata) pairs of one batch
+    """
+    page_batch_size = getattr(text_splitter, 'page_batch_size', 1)
+    batch = []
+    for page_batch in _page_batches(pages, page_batch_size):
+        if page_batch_size > 1:
+            page_chunks = text_splitter.split_texts([text for _, text in page_batch])
+        else:
+            page_chunks = [text_splitter.split_text(text) for _, text in page_batch]
+        for (page_number, _), chunks in zip(page_batch, page_chunks):
+            for chunk in chunks:
+                batch.append((chunk, {**metadata, 'page': page_number}))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def _page_batches(pages, size):
+    batch = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    This function is used to hash the content of a file without reading it into memory at once.
+
+    path: str - path to the file
+    block_size: int, default=1MB - the size of the blocks read from the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_file(path, source_name, chunk_size, chunk_overlap, known_sha256=None, splitter_options=None):
+    """
+    This function is used to read and split one file in a worker process.
+    It imports only the document parsers, so the worker doesn't load the model or the vector store.
+
+    path: str - path to the file
+    source_name: str - name of the document saved in the metadata of the chunks
+    chunk_size: int - the size of the chunks
+    chunk_overlap: int - the overlap between the chunks
+    known_sha256: str, default=None - hash from the previous run, the file is not parsed if it didn't change
+    splitter_options: dict, default=None - other arguments of make_text_splitter (unit, tokenizer_name, page_batch_size)
+
+    Returns: (str, list) - hash of the file and its (text, metadata) chunks, None instead of the chunks if the file didn't change
+    """
+    sha256 = file_sha256(path)
+    if sha256 == known_sha256:
+        return sha256, None
+    text_splitter = make_text_splitter(chunk_size, chunk_overlap, **(splitter_options or {}))
+    chunks = [chunk for batch in iter_chunk_batches(iter_pages(path), text_splitter, {'source': source_name}, 1024) for chunk in batch]
+    return sha256, chunks
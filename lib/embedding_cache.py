@@ -0,0 +1,174 @@
+import numpy as np
+import hashlib
+import json
+import os
+import threading
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+
+KEY_SIZE = 16
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed cache of embeddings.
+
+    Vectors are kept in a memory-mapped float32 matrix with a fixed number of slots,
+    the digests of the cached texts are kept in a parallel memory-mapped key matrix
+    and the LRU order of the slots is kept in a small index file.
+    When the cache is full the least recently used slot is reused.
+
+    path: str - directory of the cache
+    model_name: str - name of the embedding model, part of the cache key
+    max_entries: int, default=100000 - the maximum number of cached vectors
+    """
+
+    def __init__(self, path, model_name, max_entries=100_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.directory = Path(path) / model_name.replace('/', '__')
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / 'index.json'
+        self.vectors_path = self.directory / 'vectors.f32'
+        self.keys_path = self.directory / 'keys.bin'
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dim = None
+        self._vectors = None
+        self._keys = None
+        self._slots = OrderedDict() # digest -> slot, от старых к новым
+        self._free = []
+        self._load()
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index['model_name'] != self.model_name or index['max_entries'] != self.max_entries:
+                logging.info(f"Параметры кэша эмбеддингов изменились, кэш {self.directory} будет создан заново")
+                return
+            self._open(index['dim'], mode='r+')
+            order = index['order']
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать кэш эмбеддингов {self.directory}: {e}")
+            self._dim = self._vectors = self._keys = None
+            return
+
+        empty = bytes(KEY_SIZE)
+        for slot in order:
+            digest = self._keys[slot].tobytes()
+            if digest != empty:
+                self._slots[digest] = slot
+        used = set(self._slots.values())
+        self._free = [slot for slot in range(self.max_entries - 1, -1, -1) if slot not in used]
+        logging.info(f"Кэш эмбеддингов {self.directory}: {len(self._slots)} векторов")
+
+    def _open(self, dim, mode):
+        self._dim = dim
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(self.max_entries, dim))
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode=mode, shape=(self.max_entries, KEY_SIZE))
+        if mode == 'w+':
+            self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def _digest(self, text):
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+    def get_many(self, texts):
+        """
+        Returns the cached vectors for the texts, None for the texts which are not cached.
+
+        texts: list - the texts to look up
+        """
+        result = [None] * len(texts)
+        with self._lock:
+            if self._vectors is None:
+                self.misses += len(texts)
+                return result
+            for i, text in enumerate(texts):
+                digest = self._digest(text)
+                slot = self._slots.get(digest)
+                if slot is None or self._keys[slot].tobytes() != digest:
+                    self.misses += 1
+                    continue
+                self._slots.move_to_end(digest)
+                result[i] = np.array(self._vectors[slot])
+                self.hits += 1
+        return result
+
+    def put_many(self, texts, vectors):
+        """
+        Stores the vectors of the texts, evicting the least recently used entries if needed.
+
+        texts: list - the texts which were embedded
+        vectors: list - the embeddings of the texts
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._open(vectors.shape[1], mode='w+')
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Размерность эмбеддингов {vectors.shape[1]} не совпадает с кэшем ({self._dim})")
+            for text, vector in zip(texts, vectors):
+                digest = self._digest(text)
+                slot = self._slots.get(digest)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                    else:
+                        _, slot = self._slots.popitem(last=False)
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(digest, dtype=np.uint8)
+                self._slots[digest] = slot
+                self._slots.move_to_end(digest)
+
+    def flush(self):
+        """
+        Writes the vectors and the LRU order to disk.
+        """
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            self._keys.flush()
+            index = {
+                'model_name': self.model_name,
+                'max_entries': self.max_entries,
+                'dim': self._dim,
+                'order': list(self._slots.values())
+            }
+            tmp_path = self.index_path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def __len__(self):
+        return len(self._slots)
+
+
+def embed_with_cache(texts, embed, cache=None):
+    """
+    Embeds the texts, running the model only for the texts which are not in the cache.
+
+    texts: list - the texts to embed
+    embed: callable - function which embeds a list of texts
+    cache: EmbeddingCache, default=None - the cache to consult, the model is always used if None
+    """
+    if cache is None:
+        return np.asarray(embed(texts), dtype=np.float32).tolist()
+
+    vectors = cache.get_many(texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        computed = embed([texts[i] for i in missing])
+        cache.put_many([texts[i] for i in missing], computed)
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
+    return np.asarray(vectors, dtype=np.float32).tolist()
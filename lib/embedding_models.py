@@ -0,0 +1,184 @@
+import numpy as np
+import base64
+import threading
+import time
+import logging
+
+
+E5_QUERY_PREFIX = "query: "
+E5_PASSAGE_PREFIX = "passage: "
+
+
+class EmbeddingModel:
+    """
+    Lazily loaded sentence-transformers model shared by ingestion and queries.
+
+    e5 models expect "query: " before questions and "passage: " before documents,
+    the prefixes are added here so every caller embeds texts the same way.
+    The object can be passed to chromadb as an embedding function.
+
+    model_name: str - name of the model on the huggingface hub
+    device: str, default=None - torch device, chosen by sentence-transformers if None
+    """
+
+    def __init__(self, model_name, device=None):
+        self.model_name = model_name
+        self.device = device
+        if 'e5' in model_name.lower():
+            self.query_prefix, self.passage_prefix = E5_QUERY_PREFIX, E5_PASSAGE_PREFIX
+        else:
+            self.query_prefix, self.passage_prefix = "", ""
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def signature(self):
+        """
+        String which changes whenever the produced vectors change.
+        """
+        return f"{self.model_name}|{self.passage_prefix}"
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """
+        Loads the model once, concurrent callers wait for the first load.
+        """
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+                    logging.info(f"Модель эмбеддингов {self.model_name} загружена, {self.memory_footprint() / 2**20:.1f} MB")
+        return self._model
+
+    def warm_up(self):
+        """
+        Loads the model and runs one forward pass, so the first real request is not slowed down.
+        """
+        self.encode([self.passage_prefix + "warm up"])
+
+    def memory_footprint(self):
+        """
+        Returns the size of the model's parameters and buffers in bytes, 0 if the model is not loaded.
+        """
+        if self._model is None:
+            return 0
+        tensors = list(self._model.parameters()) + list(self._model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def encode(self, texts):
+        """
+        Embeds the texts as they are, without prefixes.
+
+        texts: list - the texts to embed
+        """
+        return self.load().encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    def with_passage_prefix(self, texts):
+        return [self.passage_prefix + text for text in texts]
+
+    def with_query_prefix(self, texts):
+        return [self.query_prefix + text for text in texts]
+
+    def embed_documents(self, texts):
+        return self.encode(self.with_passage_prefix(texts))
+
+    def embed_query(self, text):
+        return self.encode(self.with_query_prefix([text]))[0]
+
+    def __call__(self, input):
+        # Интерфейс embedding function для chromadb
+        return self.embed_documents(input).tolist()
+
+
+class RemoteEmbeddingModel(EmbeddingModel):
+    """
+    Client of lib.embedding_server with the interface of EmbeddingModel.
+
+    The texts are embedded by the server, which batches the requests of all sessions and jobs together.
+    The signature is the same as of the local model, so chunk ids and embedding caches stay valid
+    when the app switches between the local model and the server.
+    A request rejected by the server because of a full queue (429) is repeated after Retry-After.
+
+    model_name: str - name of the model served by the server, checked on connection
+    url: str - address of the server, e.g. http://localhost:8090
+    timeout: float, default=30 - timeout of every request in seconds
+    max_retries: int, default=5 - the number of attempts of a rejected request
+    """
+
+    def __init__(self, model_name, url, timeout=30, max_retries=5):
+        super().__init__(model_name)
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._client = None
+
+    @property
+    def is_loaded(self):
+        return self._client is not None
+
+    def load(self):
+        """
+        Connects to the server once and checks that it serves the same model.
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+                    client = httpx.Client(base_url=self.url, timeout=self.timeout)
+                    served = client.get('/health').raise_for_status().json()['model']
+                    if served != self.model_name:
+                        client.close()
+                        raise ValueError(f"Сервер эмбеддингов {self.url} использует модель {served}, а не {self.model_name}")
+                    self._client = client
+                    logging.info(f"Подключение к серверу эмбеддингов {self.url}: SUCCESS")
+        return self._client
+
+    def memory_footprint(self):
+        return 0
+
+    def encode(self, texts):
+        client = self.load()
+        for attempt in range(1, self.max_retries + 1):
+            response = client.post('/encode', json={'texts': list(texts)})
+            if response.status_code == 429 and attempt < self.max_retries:
+                time.sleep(float(response.headers.get('Retry-After', 0.1)))
+                continue
+            response.raise_for_status()
+            data = response.json()
+            return np.frombuffer(base64.b64decode(data['embeddings']), dtype=np.float32).reshape(data['count'], data['dim'])
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_embedding_model(model_name, device=None, url=None, timeout=30, max_retries=5):
+    """
+    Returns the process-wide model with the given name, the weights are loaded on first use.
+
+    model_name: str - name of the model on the huggingface hub
+    device: str, default=None - torch device, used only when the model is created
+    url: str, default=None - address of lib.embedding_server, the model is loaded in this process if None
+    timeout: float, default=30 - timeout of the requests to the server
+    max_retries: int, default=5 - the number of attempts of a request rejected by the server
+    """
+    key = model_name if url is None else f"{model_name}@{url}"
+    with _models_lock:
+        if key not in _models:
+            if url is None:
+                _models[key] = EmbeddingModel(model_name, device=device)
+            else:
+                _models[key] = RemoteEmbeddingModel(model_name, url, timeout=timeout, max_retries=max_retries)
+        return _models[key]
+
+
+def loaded_models():
+    """
+    Returns the memory footprint in bytes of every model in the registry.
+    """
+    with _models_lock:
+        return {name: model.memory_footprint() for name, model in _models.items()}
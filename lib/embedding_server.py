@@ -0,0 +1,134 @@
+"""
+Local embedding server: one copy of the embedding model for all app sessions, workers and ingestion jobs.
+
+Concurrent /encode requests are coalesced by lib.micro_batcher into batches of up to max_batch_size texts,
+a request waits at most max_wait_ms for others to join its batch. When the queue is full the server
+answers 429 with Retry-After, RemoteEmbeddingModel repeats such requests.
+
+Run from the repository root:
+    python -m lib.embedding_server --config streamlit_app/config.yaml
+
+and set embedding_server.url in config.yaml, e.g. http://localhost:8090.
+
+POST /encode {"texts": [...]} - the texts are embedded as they are, the e5 prefixes are added by the client.
+Returns {"count": n, "dim": d, "embeddings": base64 of the (n, d) float32 matrix}.
+GET /health, GET /stats (batch size and latency), GET /metrics (Prometheus).
+"""
+import argparse
+import asyncio
+import base64
+import logging
+from contextlib import asynccontextmanager
+
+import numpy as np
+import yaml
+
+from lib.embedding_models import get_embedding_model
+from lib.metrics import metrics
+from lib.micro_batcher import MicroBatcher, Overloaded
+
+
+DEFAULT_MODEL_NAME = "intfloat/multilingual-e5-small"
+
+
+def create_app(model_name=DEFAULT_MODEL_NAME, device=None, max_batch_size=64, max_wait_ms=5, max_queue=4096):
+    """
+    Creates the FastAPI application of the server, the model is loaded and warmed up on startup.
+
+    model_name: str, default=DEFAULT_MODEL_NAME - name of the model on the huggingface hub
+    device: str, default=None - torch device of the model
+    max_batch_size: int, default=64 - the number of texts encoded at once
+    max_wait_ms: float, default=5 - the longest time a request waits for other requests to join its batch
+    max_queue: int, default=4096 - the number of waiting texts above which requests are rejected with 429
+
+    Returns: FastAPI - the application
+    """
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, PlainTextResponse
+    from pydantic import BaseModel
+
+    model = get_embedding_model(model_name, device=device)
+    batcher = MicroBatcher(model.encode, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_queue=max_queue)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Модель загружается в потоке, чтобы не блокировать event loop
+        await asyncio.to_thread(model.warm_up)
+        logging.info(f"Сервер эмбеддингов готов: {model_name}, батч до {max_batch_size} текстов, ожидание до {max_wait_ms} мс")
+        yield
+        batcher.stop()
+
+    app = FastAPI(title="Embedding server", lifespan=lifespan)
+
+    class EncodeRequest(BaseModel):
+        texts: list[str]
+
+    @app.post('/encode')
+    async def encode(request: EncodeRequest):
+        try:
+            future = batcher.submit(request.texts)
+        except Overloaded as e:
+            # Клиент повторяет запрос после паузы, пока очередь не разгрузится
+            return JSONResponse(status_code=429, content={'detail': str(e)}, headers={'Retry-After': str(max(max_wait_ms / 1000, 0.05))})
+        vectors = np.ascontiguousarray(await asyncio.wrap_future(future), dtype=np.float32)
+        return {
+            'count': len(request.texts),
+            'dim': int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            'embeddings': base64.b64encode(vectors.tobytes()).decode('ascii')
+        }
+
+    @app.get('/health')
+    def health():
+        return {'model': model_name, 'signature': model.signature, 'loaded': model.is_loaded}
+
+    @app.get('/stats')
+    def stats():
+        return batcher.stats()
+
+    @app.get('/metrics')
+    def prometheus():
+        return PlainTextResponse(metrics.render_prometheus())
+
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=None, help='config.yaml with the embedding_server section')
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--model', default=DEFAULT_MODEL_NAME)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--max-batch-size', type=int, default=None)
+    parser.add_argument('--max-wait-ms', type=float, default=None)
+    parser.add_argument('--max-queue', type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server_config = {}
+    if args.config is not None:
+        with open(args.config, 'r') as f:
+            server_config = yaml.safe_load(f).get('embedding_server', {})
+
+    def option(name, default):
+        value = getattr(args, name)
+        return value if value is not None else server_config.get(name, default)
+
+    app = create_app(
+        model_name=args.model,
+        device=args.device,
+        max_batch_size=option('max_batch_size', 64),
+        max_wait_ms=option('max_wait_ms', 5),
+        max_queue=option('max_queue', 4096)
+    )
+    import uvicorn
+
+    # Один процесс: модель и батчер общие для всех запросов, параллельность дают батчи
+    uvicorn.run(app, host=option('host', '127.0.0.1'), port=option('port', 8090))
+
+
+if __name__ == '__main__':
+    main()
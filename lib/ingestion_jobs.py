@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict, deque
+from pathlib import Path
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class IngestionJobQueue:
+    """
+    Pool of worker threads which run uploads in the background.
+
+    Every upload gets a job id. The status of the job (state, processed chunks, throughput, error)
+    is saved to a json file, so it survives reruns of the Streamlit script and restarts of the process.
+    Jobs of different owners are taken in turn, so one user with many uploads doesn't block the others.
+    Finished, failed and cancelled jobs are forgotten and their files deleted after max_age_days,
+    and beyond the max_finished_jobs most recently finished ones.
+
+    target: callable - function which runs an upload, called as target(**kwargs, progress_callback=..., cancel_event=...)
+    jobs_dir: str - directory for the status files
+    workers: int, default=2 - the number of uploads running at the same time
+    max_finished_jobs: int, default=1000 - the number of finished jobs kept, no limit if None
+    max_age_days: float, default=7 - days a finished job is kept, no limit if None
+    """
+
+    def __init__(self, target, jobs_dir, workers=2, max_finished_jobs=1000, max_age_days=7):
+        self.target = target
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.max_finished_jobs = max_finished_jobs
+        self.max_age_days = max_age_days
+
+        self._cond = threading.Condition()
+        self._queues = OrderedDict() # owner -> очередь id задач
+        self._tasks = {}
+        self._cancel_events = {}
+        self._statuses = {}
+        self._last_saved = {}
+        self._load_statuses()
+
+        self._workers = [threading.Thread(target=self._work, name=f"ingestion-worker-{i}", daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _load_statuses(self):
+        for path in self.jobs_dir.glob('*.json'):
+            try:
+                with open(path) as f:
+                    status = json.load(f)
+            except Exception as e:
+                logging.warning(f"Не удалось прочитать статус задачи {path}: {e}")
+                continue
+            if status['state'] not in FINISHED_STATES:
+                # Задача осталась от остановленного процесса, ее данные не сохранились
+                status.update(state=FAILED, error='interrupted by restart', finished_at=time.time())
+                self._save(status)
+            self._statuses[status['job_id']] = status
+        self._prune()
+
+    def _prune(self):
+        # Вызывается под self._cond или до запуска воркеров
+        finished = sorted(
+            (status for status in self._statuses.values() if status['state'] in FINISHED_STATES),
+            key=lambda status: status['finished_at'] or 0,
+            reverse=True
+        )
+        expired = []
+        if self.max_age_days is not None:
+            oldest = time.time() - self.max_age_days * 86400
+            expired += [status for status in finished if (status['finished_at'] or 0) < oldest]
+        if self.max_finished_jobs is not None:
+            expired += finished[self.max_finished_jobs:]
+        removed = 0
+        for status in expired:
+            job_id = status['job_id']
+            if self._statuses.pop(job_id, None) is None:
+                continue
+            self._last_saved.pop(job_id, None)
+            (self.jobs_dir / f"{job_id}.json").unlink(missing_ok=True)
+            removed += 1
+        if removed:
+            logging.info(f"Удалены статусы старых задач загрузки: {removed}")
+
+    def _save(self, status):
+        path = self.jobs_dir / f"{status['job_id']}.json"
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._last_saved[status['job_id']] = time.monotonic()
+
+    def submit(self, owner, **kwargs):
+        """
+        Puts an upload into the queue.
+
+        owner: str - user who started the upload, used for fair scheduling
+        kwargs: arguments of the target function
+
+        Returns: str - id of the job
+        """
+        job_id = uuid.uuid4().hex
+        status = {
+            'job_id': job_id,
+            'owner': owner,
+            'state': QUEUED,
+            'description': str(kwargs.get('collection_name', '')),
+            'chunks_processed': 0,
+            'chunks_added': 0,
+            'chunks_per_second': 0.0,
+            'report': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self._cond:
+            self._statuses[job_id] = status
+            self._tasks[job_id] = kwargs
+            self._cancel_events[job_id] = threading.Event()
+            self._queues.setdefault(owner, deque()).append(job_id)
+            self._save(status)
+            self._cond.notify()
+        logging.info(f"Задача загрузки {job_id} от {owner} поставлена в очередь")
+        return job_id
+
+    def status(self, job_id):
+        """
+        Returns a copy of the job's status, None if the job is unknown.
+        """
+        with self._cond:
+            status = self._statuses.get(job_id)
+            return dict(status) if status is not None else None
+
+    def jobs(self, owner=None):
+        """
+        Returns the statuses of all jobs, or of the jobs of one owner.
+        """
+        with self._cond:
+            return [dict(status) for status in self._statuses.values() if owner is None or status['owner'] == owner]
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job or asks a running job to stop after the current batch.
+
+        Returns: bool - False if the job is already finished or unknown
+        """
+        with self._cond:
+            status = self._statuses.get(job_id)
+            if status is None or status['state'] in FINISHED_STATES:
+                return False
+            self._cancel_events[job_id].set()
+            if status['state'] == QUEUED:
+                self._queues[status['owner']].remove(job_id)
+                self._finish(status, CANCELLED)
+        logging.info(f"Задача загрузки {job_id} отменена")
+        return True
+
+    def _finish(self, status, state, error=None):
+        status.update(state=state, error=error, finished_at=time.time())
+        self._tasks.pop(status['job_id'], None)
+        self._cancel_events.pop(status['job_id'], None)
+        self._save(status)
+        self._prune()
+
+    def _next_job(self):
+        # Владельцы обходятся по кругу: берется первая задача первого владельца, владелец уходит в конец
+        while True:
+            for owner in list(self._queues):
+                queue = self._queues.pop(owner)
+                if queue:
+                    job_id = queue.popleft()
+                    if queue:
+                        self._queues[owner] = queue
+                    return job_id
+            self._cond.wait()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job_id = self._next_job()
+                status = self._statuses[job_id]
+                kwargs = self._tasks[job_id]
+                cancel_event = self._cancel_events[job_id]
+                status.update(state=RUNNING, started_at=time.time())
+                self._save(status)
+
+            def progress_callback(report, status=status):
+                with self._cond:
+                    elapsed = max(time.time() - status['started_at'], 1e-6)
+                    processed = report['added'] + report['unchanged']
+                    status.update(
+                        chunks_processed=processed,
+                        chunks_added=report['added'],
+                        chunks_per_second=round(processed / elapsed, 1)
+                    )
+                    if time.monotonic() - self._last_saved.get(status['job_id'], 0) >= 1:
+                        self._save(status)
+
+            try:
+                report = self.target(**kwargs, progress_callback=progress_callback, cancel_event=cancel_event)
+            except Exception as e:
+                logging.exception(f"Ошибка в задаче загрузки {job_id}")
+                report, error = None, str(e)
+            else:
+                error = None if report is not None else 'upload failed, see logs'
+
+            with self._cond:
+                status['report'] = report
+                if cancel_event.is_set():
+                    self._finish(status, CANCELLED)
+                elif report is None:
+                    self._finish(status, FAILED, error)
+                else:
+                    self._finish(status, DONE)
+            logging.info(f"Задача загрузки {job_id}: {status['state']}")
@@ -0,0 +1,636 @@
+import numpy as np
+import json
+import os
+import shutil
+import threading
+import uuid
+import logging
+from pathlib import Path
+
+from lib.vector_codec import VectorCodec
+
+
+INITIAL_CAPACITY = 1024
+HNSW_M = 16
+
+
+def _hnsw_bytes(elements, dim):
+    """
+    Estimated memory of an hnswlib index: float32 vector, level 0 links, label and link count of every element.
+    The upper levels hold about 1/M of the elements and are left out.
+    """
+    return elements * (dim * 4 + 2 * HNSW_M * 4 + 4 + 8)
+
+
+def _matches(metadata, where):
+    """
+    Checks the metadata of a chunk against a chroma-style where filter.
+    Supported: {"key": value}, {"key": {"$eq"|"$ne"|"$in"|"$nin"|"$gt"|"$gte"|"$lt"|"$lte": value}}, {"$and": [...]}, {"$or": [...]}
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(_matches(metadata, sub) for sub in condition):
+                return False
+        elif key == '$or':
+            if not any(_matches(metadata, sub) for sub in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, operand in condition.items():
+                if operator == '$eq' and not value == operand: return False
+                if operator == '$ne' and not value != operand: return False
+                if operator == '$in' and value not in operand: return False
+                if operator == '$nin' and value in operand: return False
+                if operator in ('$gt', '$gte', '$lt', '$lte') and value is None: return False
+                if operator == '$gt' and not value > operand: return False
+                if operator == '$gte' and not value >= operand: return False
+                if operator == '$lt' and not value < operand: return False
+                if operator == '$lte' and not value <= operand: return False
+    return True
+
+
+def _as_matrix(embeddings):
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    return matrix
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class LocalCollection:
+    """
+    In-process collection with the same interface as a chromadb collection
+    (upsert/add, get, delete, query, count), stored in a directory on disk.
+
+    Vectors are kept in a memory-mapped float32 matrix, one row per chunk, rows of deleted chunks are reused.
+    Documents and metadata are kept in an append-only log which is replayed on load.
+    Small collections are searched exactly with one matrix product,
+    collections above hnsw_threshold are searched with an HNSW index which is saved next to the matrix.
+    Cosine distance is used, the vectors are normalized on insert.
+    Equality filters ($eq, $in) of where are answered from an index of the rows of every (key, value)
+    of the metadata, other operators are checked row by row.
+    The directory must be used by one process at a time.
+
+    Compact mode is set by the metadata of the collection when it is created:
+    "vectors:dtype" ('float16' or 'int8') and/or "vectors:pca_dim" (number of PCA dimensions).
+    Once the collection has "vectors:fit_rows" chunks, a VectorCodec is fitted on them and the search
+    runs over the compact codes. Without PCA the codes are always scanned exactly: an HNSW index keeps
+    float32 vectors of the full dimension and would take more memory than the collection without codes.
+    With PCA, collections above hnsw_threshold use an HNSW index of the reduced vectors.
+    The best rescore_factor * n_results candidates are then re-scored exactly with the float32 rows from disk,
+    so only the codes (and the reduced HNSW index) have to stay in memory.
+
+    directory: Path - directory of the collection
+    name: str - name of the collection
+    metadata: dict, default=None - metadata of the collection
+    embedding_function: callable, default=None - used when documents are added or queried without embeddings
+    hnsw_threshold: int, default=5000 - the number of chunks from which the HNSW index is used
+    """
+
+    def __init__(self, directory, name, metadata=None, embedding_function=None, hnsw_threshold=5000):
+        self.directory = Path(directory)
+        self.name = name
+        self.embedding_function = embedding_function
+        self.hnsw_threshold = hnsw_threshold
+        self._lock = threading.RLock()
+        self._meta_path = self.directory / 'collection.json'
+        self._log_path = self.directory / 'records.jsonl'
+        self._vectors_path = self.directory / 'vectors.f32'
+        self._hnsw_path = self.directory / 'hnsw.bin'
+        self._codec_path = self.directory / 'codec.npz'
+        self._codes_path = self.directory / 'codes.bin'
+        self._hnsw = None
+        self._hnsw_dirty = False
+        self._codec = None # обученный кодек, до обучения поиск идет по полным векторам
+        self._codes = None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self._meta_path.exists():
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+        else:
+            meta = {'name': name, 'id': str(uuid.uuid4()), 'metadata': metadata or {}, 'dim': None, 'capacity': 0, 'hnsw_version': None}
+        self._meta = meta
+        self.id = meta['id']
+        self.metadata = meta['metadata']
+        codec = VectorCodec(self.metadata.get('vectors:dtype', 'float32'), self.metadata.get('vectors:pca_dim'))
+        self._codec_template = None if codec.is_identity else codec
+        self.rescore_factor = self.metadata.get('vectors:rescore_factor', 4)
+        self._codec_fit_rows = max(self.metadata.get('vectors:fit_rows', 1000), 2 * (codec.pca_dim or 0))
+
+        self._rows = {} # id -> номер строки в матрице
+        self._ids = [] # номер строки -> id
+        self._documents = []
+        self._metadatas = []
+        self._value_rows = {} # (ключ, значение) метаданных -> строки, для фильтров на равенство
+        self._alive = np.zeros(0, dtype=bool)
+        self._free_rows = [] # строки удаленных чанков, новые чанки занимают их, прежде чем расширять матрицу
+        self._version = 0 # число изменений, по нему проверяется актуальность сохраненного HNSW
+        self._vectors = None
+        self._replay_log()
+        if meta['dim'] is not None:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(meta['capacity'], meta['dim']))
+            if self._codec_path.exists():
+                self._codec = VectorCodec.load(self._codec_path)
+                self._open_codes()
+        self._save_meta()
+        self._log = open(self._log_path, 'a', encoding='utf-8')
+
+    def _replay_log(self):
+        if not self._log_path.exists():
+            return
+        with open(self._log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break # Недописанная строка после падения процесса
+                if record['op'] == 'upsert':
+                    self._set_row(record['row'], record['id'], record['document'], record['metadata'])
+                else:
+                    self._drop_row(record['id'])
+                self._version += 1
+        self._alive = np.zeros(len(self._ids), dtype=bool)
+        self._alive[list(self._rows.values())] = True
+        self._free_rows = [row for row in range(len(self._ids) - 1, -1, -1) if self._ids[row] is None]
+
+    def _set_row(self, row, chunk_id, document, metadata):
+        while len(self._ids) <= row:
+            self._ids.append(None)
+            self._documents.append(None)
+            self._metadatas.append(None)
+        if self._metadatas[row] is not None:
+            self._unindex_metadata(row)
+        self._ids[row] = chunk_id
+        self._documents[row] = document
+        self._metadatas[row] = metadata or {}
+        self._rows[chunk_id] = row
+        for item in self._metadatas[row].items():
+            self._value_rows.setdefault(item, set()).add(row)
+
+    def _unindex_metadata(self, row):
+        for item in self._metadatas[row].items():
+            rows = self._value_rows.get(item)
+            if rows is not None:
+                rows.discard(row)
+                if not rows:
+                    del self._value_rows[item]
+
+    def _drop_row(self, chunk_id):
+        row = self._rows.pop(chunk_id, None)
+        if row is not None:
+            self._unindex_metadata(row)
+            self._ids[row] = None
+            self._documents[row] = None
+            self._metadatas[row] = None
+        return row
+
+    def _save_meta(self):
+        tmp_path = self._meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _ensure_capacity(self, rows, dim):
+        if self._meta['dim'] is None:
+            self._meta['dim'] = dim
+        elif dim != self._meta['dim']:
+            raise ValueError(f"Размерность эмбеддингов {dim} не совпадает с коллекцией ({self._meta['dim']})")
+        capacity = self._meta['capacity']
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity = max(INITIAL_CAPACITY, capacity * 2)
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        # Матрица хранится построчно, поэтому увеличение файла не сдвигает существующие строки
+        with open(self._vectors_path, 'ab') as f:
+            f.truncate(capacity * dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, dim))
+        self._meta['capacity'] = capacity
+        self._save_meta()
+        if self._codec is not None:
+            self._open_codes()
+
+    def _open_codes(self):
+        capacity, out_dim = self._meta['capacity'], self._codec.out_dim(self._meta['dim'])
+        if self._codes is not None:
+            self._codes.flush()
+            self._codes = None
+        with open(self._codes_path, 'ab') as f:
+            f.truncate(capacity * out_dim * self._codec.itemsize)
+        self._codes = np.memmap(self._codes_path, dtype=self._codec.dtype, mode='r+', shape=(capacity, out_dim))
+
+    def _fit_codec(self):
+        rows = np.flatnonzero(self._alive)
+        codec = VectorCodec(self._codec_template.dtype, self._codec_template.pca_dim)
+        codec.fit(np.asarray(self._vectors[rows]))
+        codec.save(self._codec_path)
+        self._codec = codec
+        self._open_codes()
+        for start in range(0, len(rows), 65536):
+            block = rows[start:start + 65536]
+            self._codes[block] = codec.encode(np.asarray(self._vectors[block]))
+        self._codes.flush()
+        # Старый HNSW построен по полным векторам, новый строится по сжатым при первом поиске
+        self._hnsw = None
+        self._hnsw_dirty = False
+        self._meta['hnsw_version'] = None
+        self._save_meta()
+        logging.info(f"Коллекция {self.name} переведена в компактный режим {codec.dtype}, PCA: {codec.pca_dim}, векторов: {len(rows)}")
+
+    def _index_vectors(self, rows):
+        # Векторы, по которым строится HNSW: полные или восстановленные из кодов
+        if self._codec is None:
+            return np.asarray(self._vectors[rows])
+        return self._codec.decode(self._codes[rows])
+
+    def _uses_hnsw(self):
+        if self._codec is not None and not self._codec.pca_dim:
+            return False
+        return len(self._rows) >= self.hnsw_threshold
+
+    def count(self):
+        with self._lock:
+            return len(self._rows)
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        ids = [ids] if isinstance(ids, str) else list(ids)
+        if isinstance(documents, str):
+            documents = [documents]
+        if isinstance(metadatas, dict):
+            metadatas = [metadatas]
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        vectors = _normalize(_as_matrix(embeddings))
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+
+        with self._lock:
+            rows = []
+            new_rows = {}
+            next_row = len(self._ids)
+            for chunk_id in ids:
+                row = self._rows.get(chunk_id, new_rows.get(chunk_id))
+                if row is None:
+                    if self._free_rows:
+                        row = self._free_rows.pop()
+                    else:
+                        row, next_row = next_row, next_row + 1
+                    new_rows[chunk_id] = row
+                rows.append(row)
+            self._ensure_capacity(next_row, vectors.shape[1])
+
+            for row, chunk_id, document, metadata in zip(rows, ids, documents, metadatas):
+                self._set_row(row, chunk_id, document, metadata)
+                self._log.write(json.dumps({'op': 'upsert', 'row': row, 'id': chunk_id, 'document': document, 'metadata': metadata}, ensure_ascii=False) + '\n')
+            self._vectors[rows] = vectors
+            self._vectors.flush()
+            if self._codec is not None:
+                self._codes[rows] = self._codec.encode(vectors)
+                self._codes.flush()
+            self._log.flush()
+            if len(self._alive) < len(self._ids):
+                self._alive = np.concatenate([self._alive, np.zeros(len(self._ids) - len(self._alive), dtype=bool)])
+            self._alive[rows] = True
+            self._version += len(ids)
+
+            if self._hnsw is not None:
+                if self._hnsw.get_max_elements() < self._meta['capacity']:
+                    self._hnsw.resize_index(self._meta['capacity'])
+                self._hnsw.add_items(self._index_vectors(rows), rows)
+                self._hnsw_dirty = True
+
+            if self._codec is None and self._codec_template is not None and len(self._rows) >= self._codec_fit_rows:
+                self._fit_codec()
+
+    add = upsert
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        """
+        Changes stored chunks, unknown ids are skipped. Without embeddings the vectors are kept.
+        """
+        ids = [ids] if isinstance(ids, str) else list(ids)
+        if isinstance(documents, str):
+            documents = [documents]
+        if isinstance(metadatas, dict):
+            metadatas = [metadatas]
+        with self._lock:
+            known = [i for i, chunk_id in enumerate(ids) if chunk_id in self._rows]
+            if embeddings is not None:
+                rows = [self._rows[ids[i]] for i in known]
+                self.upsert(
+                    ids=[ids[i] for i in known],
+                    embeddings=_as_matrix(embeddings)[known],
+                    documents=[documents[i] if documents is not None else self._documents[row] for i, row in zip(known, rows)],
+                    metadatas=[metadatas[i] if metadatas is not None else self._metadatas[row] for i, row in zip(known, rows)]
+                )
+                return
+            for i in known:
+                chunk_id = ids[i]
+                row = self._rows[chunk_id]
+                document = documents[i] if documents is not None else self._documents[row]
+                metadata = metadatas[i] if metadatas is not None else self._metadatas[row]
+                self._set_row(row, chunk_id, document, metadata)
+                self._log.write(json.dumps({'op': 'upsert', 'row': row, 'id': chunk_id, 'document': document, 'metadata': metadata}, ensure_ascii=False) + '\n')
+                self._version += 1
+            self._log.flush()
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            if ids is None or where:
+                ids = [self._ids[row] for row in self._select_rows(ids, where)]
+            for chunk_id in ids:
+                row = self._drop_row(chunk_id)
+                if row is None:
+                    continue
+                self._alive[row] = False
+                self._free_rows.append(row)
+                self._log.write(json.dumps({'op': 'delete', 'id': chunk_id}) + '\n')
+                self._version += 1
+                if self._hnsw is not None:
+                    self._hnsw.mark_deleted(row)
+                    self._hnsw_dirty = True
+            self._log.flush()
+
+    def _rows_mask(self, rows):
+        mask = np.zeros(len(self._ids), dtype=bool)
+        mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+        return mask
+
+    def _where_mask(self, where, mask=None):
+        """
+        Returns: np.ndarray - bool mask of the rows matching the where filter, deleted rows are False
+
+        mask: np.ndarray, default=None - rows to check, all alive rows if None
+        """
+        mask = self._alive.copy() if mask is None else mask.copy()
+        scanned = {}
+        for key, condition in where.items():
+            if key == '$and':
+                for sub in condition:
+                    mask = self._where_mask(sub, mask)
+                continue
+            if key == '$or':
+                masks = [self._where_mask(sub, mask) for sub in condition]
+                mask &= np.logical_or.reduce(masks) if masks else False
+                continue
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, operand in condition.items():
+                if operator == '$eq':
+                    mask &= self._rows_mask(self._value_rows.get((key, operand), ()))
+                elif operator == '$in':
+                    rows = set()
+                    for value in operand:
+                        rows |= self._value_rows.get((key, value), set())
+                    mask &= self._rows_mask(rows)
+                else:
+                    scanned.setdefault(key, {})[operator] = operand
+        if scanned:
+            # Прочие операторы проверяются построчно, только на строках, прошедших фильтры на равенство
+            for row in np.flatnonzero(mask):
+                mask[row] = _matches(self._metadatas[row], scanned)
+        return mask
+
+    def _select_rows(self, ids=None, where=None):
+        mask = self._where_mask(where) if where else None
+        if ids is not None:
+            return [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows and (mask is None or mask[self._rows[chunk_id]])]
+        return np.flatnonzero(self._alive if mask is None else mask).tolist()
+
+    def _result(self, rows, include):
+        result = {'ids': [self._ids[row] for row in rows]}
+        result['documents'] = [self._documents[row] for row in rows] if 'documents' in include else None
+        result['metadatas'] = [self._metadatas[row] for row in rows] if 'metadatas' in include else None
+        result['embeddings'] = self._vectors[rows].tolist() if 'embeddings' in include and rows else ([] if 'embeddings' in include else None)
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=('documents', 'metadatas')):
+        if isinstance(ids, str):
+            ids = [ids]
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            offset = offset or 0
+            rows = rows[offset:offset + limit] if limit is not None else rows[offset:]
+            return self._result(rows, include)
+
+    def _hnsw_index(self):
+        # Индекс строится один раз, дальше обновляется при upsert/delete и сохраняется в persist()
+        if self._hnsw is not None:
+            return self._hnsw
+        import hnswlib
+        dim = self._codec.out_dim(self._meta['dim']) if self._codec is not None else self._meta['dim']
+        index = hnswlib.Index(space='ip', dim=dim)
+        if self._hnsw_path.exists() and self._meta['hnsw_version'] == self._version:
+            index.load_index(str(self._hnsw_path), max_elements=self._meta['capacity'])
+        else:
+            index.init_index(max_elements=self._meta['capacity'], ef_construction=200, M=HNSW_M)
+            rows = np.flatnonzero(self._alive)
+            if len(rows):
+                index.add_items(self._index_vectors(rows), rows)
+            self._hnsw_dirty = True
+            logging.info(f"HNSW индекс коллекции {self.name} построен: {len(rows)} векторов")
+        self._hnsw = index
+        return index
+
+    def _search(self, queries, k, where, exact=False, rescore=True):
+        """
+        Returns (rows, distances) of the k nearest chunks for every query.
+
+        exact: bool, default=False - brute force over the full float32 vectors, used as the reference of recall_at_k()
+        rescore: bool, default=True - re-score the candidates of the compact search with the full vectors
+        """
+        n_rows = len(self._ids)
+        allowed = self._where_mask(where) if where else self._alive.copy()
+        n_allowed = int(allowed.sum())
+        k = min(k, n_allowed)
+        if k == 0:
+            return [([], []) for _ in queries]
+        compact = self._codec is not None and not exact
+        n_candidates = min(k * self.rescore_factor, n_allowed) if compact and rescore else k
+
+        if exact or not self._uses_hnsw():
+            # Точный поиск: одно матричное умножение на все строки коллекции (или на их коды)
+            if compact:
+                scores = self._codec.score(queries, self._codes[:n_rows])
+            else:
+                scores = queries @ np.asarray(self._vectors[:n_rows]).T
+            scores[:, ~allowed] = -np.inf
+            top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+            candidates = [(row_candidates, query_scores[row_candidates]) for query_scores, row_candidates in zip(scores, top)]
+        else:
+            index = self._hnsw_index()
+            index.set_ef(max(n_candidates * 2, 50))
+            index_queries = self._codec.project_queries(queries) if compact else queries
+            labels, distances = index.knn_query(index_queries, k=n_candidates, filter=(lambda label: bool(allowed[label])) if where else None)
+            offsets = self._codec.query_offset(queries) if compact else np.zeros(len(queries), dtype=np.float32)
+            candidates = [(row_labels.astype(np.int64), 1 - row_distances + offset) for row_labels, row_distances, offset in zip(labels, distances, offsets)]
+
+        results = []
+        for query, (rows, scores) in zip(queries, candidates):
+            if compact and rescore:
+                # Точный пересчет кандидатов по float32 строкам с диска
+                rows = np.sort(rows)
+                scores = np.asarray(self._vectors[rows]) @ query
+            order = np.argsort(-scores)[:k]
+            results.append((rows[order].tolist(), (1 - scores[order]).tolist()))
+        return results
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None, include=('documents', 'metadatas', 'distances')):
+        if query_embeddings is None:
+            query_texts = [query_texts] if isinstance(query_texts, str) else query_texts
+            query_embeddings = self.embedding_function(query_texts)
+        queries = _normalize(_as_matrix(query_embeddings))
+        with self._lock:
+            result = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+            for rows, distances in self._search(queries, n_results, where):
+                found = self._result(rows, include)
+                result['ids'].append(found['ids'])
+                result['documents'].append(found['documents'])
+                result['metadatas'].append(found['metadatas'])
+                result['distances'].append(distances)
+            return result
+
+    def recall_at_k(self, query_embeddings, k=10):
+        """
+        Compares the search of the collection with the exact search over the full float32 vectors.
+
+        query_embeddings: list - the queries of the report, e.g. embeddings of real questions
+        k: int, default=10 - the number of results compared per query
+
+        Returns: dict - recall@k with and without re-scoring and the memory of the full and compact search,
+        the memory of an HNSW index is estimated and included when the collection would use one
+        """
+        queries = _normalize(_as_matrix(query_embeddings))
+        with self._lock:
+            reference = self._search(queries, k, None, exact=True)
+            report = {'k': k, 'queries': len(queries), 'chunks': len(self._rows)}
+            for name, rescore in (('recall', True), ('recall_without_rescore', False)):
+                found = self._search(queries, k, None, rescore=rescore)
+                hits = [len(set(rows) & set(reference_rows)) / max(len(reference_rows), 1) for (rows, _), (reference_rows, _) in zip(found, reference)]
+                report[name] = float(np.mean(hits)) if hits else None
+            dim = self._meta['dim'] or 0
+            n_chunks = len(self._rows)
+            # Над порогом полный режим ищет по HNSW, который сам хранит float32 векторы
+            report['full_bytes'] = _hnsw_bytes(n_chunks, dim) if n_chunks >= self.hnsw_threshold else n_chunks * dim * 4
+            if self._codec is not None:
+                out_dim = self._codec.out_dim(dim)
+                report['hnsw_bytes'] = _hnsw_bytes(n_chunks, out_dim) if self._uses_hnsw() else 0
+                report['compact_bytes'] = n_chunks * out_dim * self._codec.itemsize + report['hnsw_bytes']
+                report['codec'] = {'dtype': self._codec.dtype, 'pca_dim': self._codec.pca_dim}
+            else:
+                report['hnsw_bytes'] = _hnsw_bytes(n_chunks, dim) if self._uses_hnsw() else 0
+                report['compact_bytes'] = report['full_bytes']
+                report['codec'] = None
+            return report
+
+    def persist(self):
+        """
+        Saves the HNSW index and compacts the log if most of its records are outdated.
+        """
+        with self._lock:
+            if self._hnsw is not None and self._hnsw_dirty:
+                self._hnsw.save_index(str(self._hnsw_path))
+                self._meta['hnsw_version'] = self._version
+                self._save_meta()
+                self._hnsw_dirty = False
+            if self._version > 2 * len(self._rows) + 1000:
+                self._compact_log()
+
+    def _compact_log(self):
+        tmp_path = self._log_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for chunk_id, row in self._rows.items():
+                f.write(json.dumps({'op': 'upsert', 'row': row, 'id': chunk_id, 'document': self._documents[row], 'metadata': self._metadatas[row]}, ensure_ascii=False) + '\n')
+        self._log.close()
+        os.replace(tmp_path, self._log_path)
+        self._log = open(self._log_path, 'a', encoding='utf-8')
+        self._version = len(self._rows)
+        if self._hnsw is not None:
+            self._hnsw.save_index(str(self._hnsw_path))
+            self._meta['hnsw_version'] = self._version
+            self._hnsw_dirty = False
+        else:
+            self._meta['hnsw_version'] = None
+        self._save_meta()
+
+    def close(self):
+        with self._lock:
+            self.persist()
+            self._log.close()
+            if self._vectors is not None:
+                self._vectors.flush()
+            if self._codes is not None:
+                self._codes.flush()
+
+
+class LocalClient:
+    """
+    In-process replacement of chromadb.HttpClient which keeps LocalCollection objects in a directory.
+
+    path: str - directory of the vector store
+    hnsw_threshold: int, default=5000 - the number of chunks from which collections use the HNSW index
+    compact: dict, default=None - metadata of compact mode added to new collections, e.g. {"vectors:dtype": "int8"}
+    """
+
+    def __init__(self, path, hnsw_threshold=5000, compact=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.hnsw_threshold = hnsw_threshold
+        self.compact = compact or {}
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, name):
+        return self.path / name
+
+    def heartbeat(self):
+        return 0
+
+    def list_collections(self):
+        with self._lock:
+            names = {p.name for p in self.path.iterdir() if (p / 'collection.json').exists()}
+            return [self._open(name) for name in sorted(names)]
+
+    def _open(self, name, metadata=None, embedding_function=None):
+        collection = self._collections.get(name)
+        if collection is None:
+            if not (self._directory(name) / 'collection.json').exists():
+                metadata = {**self.compact, **(metadata or {})} # Режим хранения фиксируется при создании коллекции
+            collection = LocalCollection(self._directory(name), name, metadata, embedding_function, self.hnsw_threshold)
+            self._collections[name] = collection
+        elif embedding_function is not None:
+            collection.embedding_function = embedding_function
+        return collection
+
+    def get_or_create_collection(self, name, metadata=None, embedding_function=None):
+        with self._lock:
+            return self._open(name, metadata, embedding_function)
+
+    def get_collection(self, name, embedding_function=None):
+        with self._lock:
+            if name not in self._collections and not (self._directory(name) / 'collection.json').exists():
+                raise ValueError(f"Collection {name} does not exist.")
+            return self._open(name, embedding_function=embedding_function)
+
+    def delete_collection(self, name):
+        with self._lock:
+            collection = self._collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(self._directory(name), ignore_errors=True)
+
+    def persist(self):
+        with self._lock:
+            for collection in self._collections.values():
+                collection.persist()
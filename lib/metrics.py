@@ -0,0 +1,220 @@
+import cProfile
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """
+    Process-wide counters and histograms of the pipeline stages and queries.
+
+    Counters count events and amounts (chunks, bytes, cache hits),
+    histograms keep count, sum, max and cumulative buckets of durations and batch sizes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds value to the counter.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        """
+        Adds one observation to the histogram.
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['max'] = max(histogram['max'], value)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Measures the duration of the block into the histogram name_seconds.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+    def add_collector(self, collector):
+        """
+        Registers a function which returns {name: value} of gauges read at export time,
+        e.g. sizes and hit counters of the caches.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _gauges(self):
+        gauges = {}
+        for collector in list(self._collectors):
+            try:
+                gauges.update(collector())
+            except Exception as e:
+                logging.warning(f"Ошибка при сборе метрик {collector}: {e}")
+        return gauges
+
+    def snapshot(self):
+        """
+        Returns all metrics as a json-serializable dict.
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self._counters.items()]
+            histograms = [
+                {'name': name, 'labels': dict(labels), 'count': h['count'], 'sum': h['sum'], 'max': h['max'],
+                 'mean': h['sum'] / h['count'] if h['count'] else 0.0}
+                for (name, labels), h in self._histograms.items()
+            ]
+        return {'counters': counters, 'histograms': histograms, 'gauges': self._gauges()}
+
+    def render_prometheus(self, prefix='rag_'):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, value in sorted(self._gauges().items()):
+            lines.append(f"# TYPE {prefix}{name} gauge")
+            lines.append(f"{prefix}{name} {value}")
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {prefix}{name} counter")
+                for (counter_name, labels), value in self._counters.items():
+                    if counter_name == name:
+                        lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for (histogram_name, labels), h in self._histograms.items():
+                    if histogram_name != name:
+                        continue
+                    for bound, count in zip(h['buckets'], h['counts']):
+                        lines.append(f"{prefix}{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"{prefix}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['count']}")
+                    lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {h['sum']}")
+                    lines.append(f"{prefix}{name}_count{_format_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = Metrics()
+
+
+def log_event(event, **fields):
+    """
+    Writes one structured json line to the 'rag.metrics' logger.
+
+    event: str - name of the event, e.g. 'upload' or 'query'
+    fields: values of the event
+    """
+    logging.getLogger('rag.metrics').info(json.dumps({'event': event, **fields}, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def profile_if_slow(name, threshold_seconds, directory):
+    """
+    Profiles the block with cProfile and saves the stats if it took longer than threshold_seconds.
+    Does nothing if threshold_seconds is None or another profiler is already running in the process.
+
+    Only the calling thread is profiled. In get_texts the pages are read and split by the producer thread
+    of the bounded queue and the batches are upserted by the uploader thread, so that work is missing
+    from the dump: there it shows up as time spent waiting on the queue and on the upload future.
+    Use the per-stage timers of metrics for the split between reading, embedding and upserting.
+
+    name: str - name of the request, part of the file name
+    threshold_seconds: float - the block is saved only if it is slower than this
+    directory: str - directory for the .prof files, they can be opened with pstats or snakeviz
+    """
+    if threshold_seconds is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # В Python 3.12+ одновременно может работать только один профилировщик
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        if elapsed >= threshold_seconds:
+            directory = Path(directory)
+            directory.mkdir(parents=True, exist_ok=True)
+            safe_name = re.sub(r"[^\w.-]", "_", name)
+            path = directory / f"{time.strftime('%Y%m%d_%H%M%S')}_{safe_name}_{int(elapsed * 1000)}ms.prof"
+            profiler.dump_stats(str(path))
+            logging.warning(f"Медленный запрос {name}: {elapsed:.2f} с, профиль сохранен в {path}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = metrics.render_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot()).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serves /metrics (Prometheus) and /metrics.json from a background thread.
+
+    port: int - port of the http server
+    host: str, default='127.0.0.1' - interface to listen on
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
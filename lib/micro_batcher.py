@@ -0,0 +1,150 @@
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from lib.metrics import SIZE_BUCKETS, metrics
+
+
+class Overloaded(Exception):
+    """
+    Raised by MicroBatcher.submit() when the queue is full, the caller should retry later.
+    """
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode requests into batches for one model.
+
+    Requests are queued, one worker thread takes the oldest request and keeps adding the next ones
+    until the batch has max_batch_size texts or max_wait_ms passed since the oldest request arrived.
+    The batch is encoded with one call and every request gets its own rows of the result.
+    When more than max_queue texts are waiting, submit() raises Overloaded instead of queueing.
+
+    encode: callable - encodes a list of texts into a (texts, dim) float32 matrix
+    max_batch_size: int, default=64 - the number of texts encoded at once
+    max_wait_ms: float, default=5 - the longest time a request waits for other requests to join its batch
+    max_queue: int, default=4096 - the number of waiting texts above which requests are rejected
+    """
+
+    def __init__(self, encode, max_batch_size=64, max_wait_ms=5, max_queue=4096):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._queue = deque() # (тексты, future, время постановки в очередь)
+        self._queued_texts = 0
+        self._stopped = False
+        self._latencies = deque(maxlen=10000)
+        self._batches = 0
+        self._texts = 0
+        self._rejected = 0
+        self._worker = threading.Thread(target=self._work, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, texts):
+        """
+        Queues the texts for encoding.
+
+        texts: list - the texts to encode
+
+        Returns: Future - resolves to the (texts, dim) float32 matrix of the texts
+        """
+        future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return future
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("MicroBatcher остановлен")
+            if self._queued_texts + len(texts) > self.max_queue and self._queue:
+                self._rejected += 1
+                metrics.inc('embedding_server_rejected_total')
+                raise Overloaded(f"В очереди {self._queued_texts} текстов, лимит {self.max_queue}")
+            self._queue.append((texts, future, time.perf_counter()))
+            self._queued_texts += len(texts)
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = self._queue[0][2] + self.max_wait
+            while True:
+                size = 0
+                batch = []
+                for texts, _, _ in self._queue:
+                    # Запрос больше max_batch_size кодируется целиком, но в одиночку
+                    if batch and size + len(texts) > self.max_batch_size:
+                        break
+                    batch.append(texts)
+                    size += len(texts)
+                remaining = deadline - time.perf_counter()
+                if size >= self.max_batch_size or len(batch) < len(self._queue) or remaining <= 0 or self._stopped:
+                    break
+                self._cond.wait(remaining)
+            requests = [self._queue.popleft() for _ in batch]
+            self._queued_texts -= size
+            return requests
+
+    def _work(self):
+        while True:
+            requests = self._next_batch()
+            if requests is None:
+                return
+            texts = [text for request_texts, _, _ in requests for text in request_texts]
+            started = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode(texts), dtype=np.float32)
+            except Exception as e:
+                logging.error(f"Ошибка при создании эмбеддингов батча из {len(texts)} текстов: {e}")
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            metrics.observe('embedding_server_encode_seconds', finished - started)
+            metrics.observe('embedding_server_batch_size', len(texts), buckets=SIZE_BUCKETS)
+            start = 0
+            for request_texts, future, queued_at in requests:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+                metrics.observe('embedding_server_request_seconds', finished - queued_at)
+                self._latencies.append(finished - queued_at)
+            with self._cond:
+                self._batches += 1
+                self._texts += len(texts)
+
+    def stats(self):
+        """
+        Returns: dict - queue depth, number of batches and texts, mean batch size and request latency percentiles in ms
+        """
+        with self._cond:
+            latencies = sorted(self._latencies)
+            stats = {
+                'queued_requests': len(self._queue),
+                'queued_texts': self._queued_texts,
+                'batches': self._batches,
+                'texts': self._texts,
+                'rejected': self._rejected,
+                'mean_batch_size': round(self._texts / self._batches, 2) if self._batches else None
+            }
+        for q in (50, 95, 99):
+            stats[f'p{q}_ms'] = round(latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))] * 1000, 2) if latencies else None
+        return stats
+
+    def stop(self):
+        """
+        Encodes the queued requests and stops the worker.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._worker.join()
@@ -0,0 +1,112 @@
+import re
+import zlib
+
+import numpy as np
+
+
+MERSENNE_PRIME = (1 << 31) - 1
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def shingles(text, size=3):
+    """
+    Returns the set of hashed word size-grams of the text, the text is compared by this set.
+    A text shorter than size words is one shingle.
+    """
+    words = [word.casefold() for word in WORD_RE.findall(text)]
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode('utf-8'))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+
+def lsh_bands(threshold, num_perm):
+    """
+    Chooses the number of bands and rows of the LSH index for the similarity threshold:
+    two texts with Jaccard similarity s share a bucket with probability 1 - (1 - s^rows)^bands,
+    which rises steeply around (1 / bands) ^ (1 / rows).
+
+    Returns: (int, int) - bands and rows per band, bands * rows <= num_perm
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicateFilter:
+    """
+    Finds near-duplicate texts with MinHash signatures of word shingles and an LSH index of their bands.
+
+    Every text added with add() is compared only with the texts which share an LSH bucket with it,
+    so the cost doesn't grow with the number of texts already seen.
+    A candidate is a duplicate if the share of equal MinHash values (an estimate of the Jaccard similarity
+    of the shingles) is at least threshold.
+
+    threshold: float, default=0.8 - Jaccard similarity from which two texts are duplicates
+    num_perm: int, default=64 - the number of hash functions of the signature
+    shingle_size: int, default=3 - the number of words in a shingle
+    seed: int, default=1 - seed of the hash functions, signatures are comparable only with the same seed
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, shingle_size=3, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # (a * x + b) mod p: x, a, b < p = 2^31 - 1, поэтому произведение помещается в uint64
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self.duplicates = 0
+
+    def signature(self, text):
+        values = np.fromiter(shingles(text, self.shingle_size), dtype=np.uint64) % MERSENNE_PRIME
+        return ((values[:, None] * self._a + self._b) % MERSENNE_PRIME).min(axis=0)
+
+    def add(self, text):
+        """
+        Adds the text to the index unless it is a near-duplicate of a text added before.
+
+        Returns: int - number of the text it duplicates in the order of add() calls, None if the text is new
+        """
+        signature = self.signature(text)
+        keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        candidates = {number for band, key in enumerate(keys) for number in self._buckets[band].get(key, ())}
+        for number in sorted(candidates):
+            if np.mean(self._signatures[number] == signature) >= self.threshold:
+                self.duplicates += 1
+                self._signatures.append(None) # номера текстов совпадают с порядком вызовов add()
+                return number
+        number = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(number)
+        return None
+
+
+def drop_near_duplicates(texts, threshold=0.8, num_perm=64, shingle_size=3):
+    """
+    Returns the texts without the near-duplicates of earlier texts, the order is kept.
+    """
+    near_duplicates = NearDuplicateFilter(threshold, num_perm, shingle_size)
+    return [text for text in texts if near_duplicates.add(text) is None]
+
+
+def iter_unique_batches(batches, near_duplicates):
+    """
+    Removes the chunks which are near-duplicates of earlier chunks of the same document.
+
+    batches: iterable - batches of (text, metadata) pairs
+    near_duplicates: NearDuplicateFilter - the filter of the document, its counter shows the number of dropped chunks
+
+    Yields: list - (text, metadata) pairs of the batch without duplicates, empty batches are skipped
+    """
+    for batch in batches:
+        unique = [(text, metadata) for text, metadata in batch if near_duplicates.add(text) is None]
+        if unique:
+            yield unique
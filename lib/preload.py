@@ -0,0 +1,65 @@
+"""
+Preload launcher of the streamlit app.
+
+Reads the config, imports the heavy modules and loads and warms up the embedding model,
+then starts streamlit in the same process, so the app answers the first request without waiting for them.
+
+Run from the repository root:
+    python -m lib.preload streamlit_app/app.py --port 8501
+
+The app runs in one process: the query cache versions, the BM25 indexes and the ingestion job statuses
+are kept in memory of that process. To share one model between several processes, use lib.embedding_server.
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+from pathlib import Path
+
+
+PRELOAD_MODULES = ('chromadb', 'langchain.text_splitter', 'pdfminer.high_level', 'pdfminer.layout')
+
+
+def preload(load_model=True, modules=PRELOAD_MODULES):
+    """
+    Reads the config, imports the heavy modules and loads the embedding model.
+
+    load_model: bool, default=True - load and warm up the embedding model
+    modules: tuple, default=PRELOAD_MODULES - modules imported before the app starts, missing ones are skipped
+    """
+    from lib import vector_db_setup
+
+    vector_db_setup.get_config()
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logging.warning(f"Модуль {module} не загружен заранее: {e}")
+    if load_model:
+        vector_db_setup.warm_up_embeddings()
+    logging.info("Предзагрузка завершена")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('script', help='streamlit script, e.g. streamlit_app/app.py')
+    parser.add_argument('--port', type=int, default=8501, help='port of the app')
+    parser.add_argument('--no-model', action='store_true', help="don't load the embedding model before the app starts")
+    args = parser.parse_args()
+
+    script = Path(args.script).resolve()
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    os.chdir(script.parent) # config.yaml, logs/ и кэши ищутся относительно папки приложения
+
+    preload(load_model=not args.no_model)
+
+    from streamlit.web import bootstrap
+
+    flag_options = {'server_port': args.port, 'server_headless': True}
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(str(script), False, [], flag_options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+
+def normalize_question(question):
+    """
+    Brings trivially different spellings of a question to one cache key:
+    repeated whitespace and trailing punctuation are ignored.
+    Case is kept: the embedding model is case-sensitive, so "XK-1234" and "xk-1234" are different questions.
+
+    question: str - the question of the user
+    """
+    return " ".join(question.split()).rstrip("?!. ")
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with hit/miss counters.
+
+    max_entries: int - the maximum number of stored values
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+class QueryCache:
+    """
+    Two-level cache of vectorstore queries.
+
+    The first level maps a normalized question to the embedding of the question as it was first typed,
+    the normalized text is only the key and is never embedded.
+    The second level maps (collection, collection version, question, n_results) to the formatted answer.
+    The version of a collection is bumped after every upload, so answers of the old data are never returned.
+
+    embeddings_max_entries: int, default=10000 - size of the embedding level
+    results_max_entries: int, default=5000 - size of the result level
+    """
+
+    def __init__(self, embeddings_max_entries=10000, results_max_entries=5000):
+        self.embeddings = LRUCache(embeddings_max_entries)
+        self.results = LRUCache(results_max_entries)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, collection_name):
+        with self._lock:
+            return self._versions.get(collection_name, 0)
+
+    def bump_version(self, collection_name):
+        """
+        Invalidates all cached results of the collection.
+
+        collection_name: str - the name of the re-ingested collection
+        """
+        with self._lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+
+    def result_key(self, collection, question, n_results, *extra):
+        return (collection.name, str(collection.id), self.version(collection.name), normalize_question(question), n_results) + extra
+
+    def stats(self):
+        return {'embeddings': self.embeddings.stats(), 'results': self.results.stats()}
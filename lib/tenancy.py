@@ -0,0 +1,210 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+
+
+def shared_collection_name(tenant, shards, prefix='shared'):
+    """
+    Returns the shared collection of the tenant: all documents of one tenant are stored in one of `shards` collections.
+
+    tenant: str - the tenant (user) id
+    shards: int - the number of shared collections
+    prefix: str, default='shared' - prefix of the collection names
+    """
+    shard = int(hashlib.sha256(tenant.encode('utf-8')).hexdigest(), 16) % shards
+    return f"{prefix}_{shard}"
+
+
+def document_filter(tenant, document=None):
+    """
+    Returns the chroma where filter of the chunks of the tenant or of one of its documents.
+    """
+    if document is None:
+        return {'tenant': tenant}
+    return {'$and': [{'tenant': tenant}, {'document': document}]}
+
+
+class DocumentRegistry:
+    """
+    SQLite table of the documents stored in shared collections: which collection keeps them,
+    how many chunks they have and when they were last uploaded or queried.
+    It is the source of the TTL and quota eviction.
+
+    Access times are written at most once per touch_interval seconds per document,
+    so queries don't turn into a write to the database each.
+
+    path: str - path of the sqlite database
+    touch_interval: float, default=60 - minimal interval between two writes of the access time of a document
+    """
+
+    def __init__(self, path, touch_interval=60):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "tenant TEXT NOT NULL, document TEXT NOT NULL, collection TEXT NOT NULL, chunks INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (tenant, document))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access)")
+
+    def register(self, tenant, document, collection, chunks):
+        """
+        Adds the document or updates its collection and the number of chunks after an upload.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (tenant, document) DO UPDATE SET collection=excluded.collection, chunks=excluded.chunks, last_access=excluded.last_access",
+                (tenant, document, collection, chunks, now, now)
+            )
+            self._touched[(tenant, document)] = now
+
+    def touch(self, tenant, document):
+        """
+        Marks the document as used now.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get((tenant, document), 0) < self.touch_interval:
+                return
+            self._db.execute("UPDATE documents SET last_access=? WHERE tenant=? AND document=?", (now, tenant, document))
+            self._touched[(tenant, document)] = now
+
+    def get(self, tenant, document):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM documents WHERE tenant=? AND document=?", (tenant, document)).fetchone()
+        return self._as_dict(row) if row is not None else None
+
+    def documents(self, tenant=None):
+        """
+        Returns the documents of the tenant (of all tenants if None), most recently used first.
+        """
+        with self._lock:
+            if tenant is None:
+                rows = self._db.execute("SELECT * FROM documents ORDER BY last_access DESC").fetchall()
+            else:
+                rows = self._db.execute("SELECT * FROM documents WHERE tenant=? ORDER BY last_access DESC", (tenant,)).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def remove(self, tenant, document):
+        with self._lock:
+            self._db.execute("DELETE FROM documents WHERE tenant=? AND document=?", (tenant, document))
+            self._touched.pop((tenant, document), None)
+
+    def expired(self, ttl_seconds, now=None):
+        """
+        Returns the documents which were not used for ttl_seconds.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM documents WHERE last_access < ? ORDER BY last_access", (now - ttl_seconds,)).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def over_quota(self, max_documents=None, max_chunks=None):
+        """
+        Returns the least recently used documents of every tenant which exceed its quota.
+
+        max_documents: int, default=None - the number of documents kept per tenant, no limit if None
+        max_chunks: int, default=None - the number of chunks kept per tenant, no limit if None
+        """
+        evicted = []
+        for tenant in self.tenants():
+            kept_documents, kept_chunks = 0, 0
+            for document in self.documents(tenant):
+                over = (max_documents is not None and kept_documents >= max_documents) or \
+                    (max_chunks is not None and kept_chunks + document['chunks'] > max_chunks and kept_documents > 0)
+                if over:
+                    evicted.append(document)
+                else:
+                    kept_documents += 1
+                    kept_chunks += document['chunks']
+        return evicted
+
+    def tenants(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT tenant FROM documents").fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _as_dict(row):
+        tenant, document, collection, chunks, created_at, last_access = row
+        return {'tenant': tenant, 'document': document, 'collection': collection, 'chunks': chunks, 'created_at': created_at, 'last_access': last_access}
+
+
+class EvictionJob:
+    """
+    Background thread which deletes documents idle for longer than ttl_seconds
+    or beyond the quota of their tenant, once every interval seconds.
+
+    registry: DocumentRegistry - the documents to check
+    evict: callable - called as evict(tenant, document, collection) for every evicted document
+    ttl_seconds: float, default=None - idle time after which a document is deleted, no TTL if None
+    max_documents: int, default=None - documents kept per tenant
+    max_chunks: int, default=None - chunks kept per tenant
+    interval: float, default=600 - seconds between two checks
+    """
+
+    def __init__(self, registry, evict, ttl_seconds=None, max_documents=None, max_chunks=None, interval=600):
+        self.registry = registry
+        self.evict = evict
+        self.ttl_seconds = ttl_seconds
+        self.max_documents = max_documents
+        self.max_chunks = max_chunks
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="eviction", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run_once(self):
+        """
+        Deletes the expired and over-quota documents now.
+
+        Returns: int - the number of deleted documents
+        """
+        candidates = []
+        if self.ttl_seconds is not None:
+            candidates += self.registry.expired(self.ttl_seconds)
+        if self.max_documents is not None or self.max_chunks is not None:
+            candidates += self.registry.over_quota(self.max_documents, self.max_chunks)
+
+        evicted = set()
+        for document in candidates:
+            key = (document['tenant'], document['document'])
+            if key in evicted:
+                continue
+            try:
+                self.evict(document['tenant'], document['document'], document['collection'])
+            except Exception as e:
+                logging.error(f"Ошибка при удалении документа {key}: {e}")
+                continue
+            self.registry.remove(*key)
+            evicted.add(key)
+        if evicted:
+            logging.info(f"Удалено документов по TTL и квотам: {len(evicted)}")
+        return len(evicted)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Ошибка в задаче удаления документов: {e}")
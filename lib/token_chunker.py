@@ -0,0 +1,94 @@
+import functools
+
+import numpy as np
+
+
+# "passage: " и служебные токены <s>, </s> добавляются к чанку при эмбеддинге
+RESERVED_TOKENS = 8
+
+
+@functools.lru_cache(maxsize=None)
+def load_tokenizer(model_name):
+    """
+    Returns the fast (rust) tokenizer of the model, loaded once per process.
+    transformers is imported here and not at the module level, it takes a few seconds to import.
+    """
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    if not tokenizer.is_fast:
+        raise ValueError(f"У модели {model_name} нет быстрого токенайзера, смещения токенов недоступны")
+    return tokenizer
+
+
+class TokenChunker:
+    """
+    Splits texts into chunks of at most chunk_size tokens of the embedding model, so no chunk is truncated by the model.
+
+    The pages are tokenized in batches by the fast tokenizer, which returns the character offsets of every token.
+    A chunk takes up to chunk_size tokens and ends before the last word start inside it,
+    the next chunk starts at the first word start in the last chunk_overlap tokens of the previous one.
+    The chunks are cut from the page by the offsets, so their text is the original text, and words are split
+    only if a word is longer than the chunk. Word starts of the whole page are found at once with numpy.
+
+    tokenizer: PreTrainedTokenizerFast - tokenizer of the embedding model
+    chunk_size: int - the maximum number of tokens in a chunk, capped by the model's limit
+    chunk_overlap: int - the number of tokens shared by neighbouring chunks
+    page_batch_size: int, default=16 - the number of pages tokenized in one call
+    """
+
+    def __init__(self, tokenizer, chunk_size, chunk_overlap, page_batch_size=16):
+        max_length = getattr(tokenizer, 'model_max_length', None)
+        if max_length is not None and max_length < 10**6:
+            chunk_size = min(chunk_size, max_length - RESERVED_TOKENS)
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"Перекрытие чанков ({chunk_overlap}) должно быть меньше размера чанка ({chunk_size})")
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.page_batch_size = page_batch_size
+
+    def split_text(self, text):
+        return self.split_texts([text])[0]
+
+    def split_texts(self, texts):
+        """
+        Returns: list - the chunks of every text
+        """
+        # verbose=False: страницы длиннее лимита модели - это нормально, они режутся ниже
+        encoding = self.tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [self._cut(text, offsets) for text, offsets in zip(texts, encoding['offset_mapping'])]
+
+    def _borders(self, offsets):
+        """
+        Returns: list - (first token, last token + 1) of every chunk
+        """
+        n = len(offsets)
+        # Токен начинает слово, если перед ним пробел; n - тоже граница слова
+        word_start = np.ones(n + 1, dtype=bool)
+        word_start[1:n] = offsets[1:, 0] > offsets[:-1, 1]
+        positions = np.arange(n + 1)
+        previous_word_start = np.maximum.accumulate(np.where(word_start, positions, 0)).tolist()
+        next_word_start = np.minimum.accumulate(np.where(word_start, positions, n)[::-1])[::-1].tolist()
+
+        borders = []
+        start, previous_end = 0, 0
+        while True:
+            end = min(start + self.chunk_size, n)
+            # Чанк без новых токенов не нужен: слово длиннее чанка режется по границе токена
+            if previous_word_start[end] > max(start, previous_end):
+                end = previous_word_start[end]
+            borders.append((start, end))
+            previous_end = end
+            if end == n:
+                return borders
+            overlap_start = max(end - self.chunk_overlap, start + 1)
+            start = min(next_word_start[overlap_start], end)
+
+    def _cut(self, text, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+        if len(offsets) == 0:
+            return []
+        borders = np.asarray(self._borders(offsets))
+        begins, ends = offsets[borders[:, 0], 0], offsets[borders[:, 1] - 1, 1]
+        chunks = [text[begin:end].strip() for begin, end in zip(begins.tolist(), ends.tolist())]
+        return [chunk for chunk in chunks if chunk]
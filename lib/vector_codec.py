@@ -0,0 +1,135 @@
+import numpy as np
+
+
+CODEC_DTYPES = ('float32', 'float16', 'int8')
+
+
+class VectorCodec:
+    """
+    Compact representation of normalized embeddings: an optional PCA projection
+    followed by float16 or int8 scalar quantization.
+
+    Data vectors are centered before the projection, queries are not,
+    so q·x ≈ q·mean + project_queries(q)·decode(encode(x)) and the ranking of the candidates is kept.
+    int8 uses a symmetric scale per dimension taken from the fitted sample, larger values are clipped.
+
+    dtype: str, default='float16' - 'float32', 'float16' or 'int8'
+    pca_dim: int, default=None - the number of dimensions kept by PCA, no projection if None
+    """
+
+    def __init__(self, dtype='float16', pca_dim=None):
+        if dtype not in CODEC_DTYPES:
+            raise ValueError(f"Неподдерживаемый тип векторов: {dtype}, доступны {CODEC_DTYPES}")
+        self.dtype = dtype
+        self.pca_dim = pca_dim
+        self.mean = None
+        self.components = None
+        self.scale = None
+        self.fitted = False
+
+    @property
+    def is_identity(self):
+        """
+        True if the codec keeps the vectors as they are.
+        """
+        return self.dtype == 'float32' and not self.pca_dim
+
+    def out_dim(self, dim):
+        return self.pca_dim if self.pca_dim else dim
+
+    @property
+    def itemsize(self):
+        return np.dtype(self.dtype).itemsize
+
+    def fit(self, matrix, max_rows=20000, seed=0):
+        """
+        Fits the PCA and the int8 scale on a sample of the vectors.
+
+        matrix: np.ndarray - normalized vectors, one per row
+        max_rows: int, default=20000 - size of the random sample used for fitting
+        seed: int, default=0 - seed of the sample
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if len(matrix) > max_rows:
+            matrix = matrix[np.random.default_rng(seed).choice(len(matrix), max_rows, replace=False)]
+        if self.pca_dim:
+            if self.pca_dim > min(matrix.shape):
+                raise ValueError(f"Для PCA до {self.pca_dim} измерений нужно не меньше {self.pca_dim} векторов, получено {len(matrix)}")
+            self.mean = matrix.mean(axis=0)
+            _, _, vt = np.linalg.svd(matrix - self.mean, full_matrices=False)
+            self.components = np.ascontiguousarray(vt[:self.pca_dim], dtype=np.float32)
+        if self.dtype == 'int8':
+            projected = self._project(matrix)
+            self.scale = np.maximum(np.abs(projected).max(axis=0), 1e-6).astype(np.float32) / 127
+        self.fitted = True
+        return self
+
+    def _project(self, matrix):
+        if self.components is None:
+            return matrix
+        return (matrix - self.mean) @ self.components.T
+
+    def project_queries(self, queries):
+        """
+        Projects the queries to the space of the decoded vectors.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        return queries @ self.components.T if self.components is not None else queries
+
+    def query_offset(self, queries):
+        """
+        Part of the score which the projection removes, the same for all vectors of one query.
+        """
+        if self.components is None:
+            return np.zeros(len(queries), dtype=np.float32)
+        return np.asarray(queries, dtype=np.float32) @ self.mean
+
+    def encode(self, matrix):
+        projected = self._project(np.asarray(matrix, dtype=np.float32))
+        if self.dtype == 'int8':
+            return np.clip(np.rint(projected / self.scale), -127, 127).astype(np.int8)
+        return projected.astype(self.dtype)
+
+    def decode(self, codes):
+        decoded = np.asarray(codes).astype(np.float32)
+        if self.dtype == 'int8':
+            decoded *= self.scale
+        return decoded
+
+    def score(self, queries, codes, block_rows=65536):
+        """
+        Approximate inner products of the queries with the encoded vectors.
+        The codes are converted to float32 by blocks, so the full matrix is never materialized.
+
+        queries: np.ndarray - normalized queries, one per row
+        codes: np.ndarray - encoded vectors, one per row
+
+        Returns: np.ndarray - (queries, vectors) matrix of scores
+        """
+        projected = self.project_queries(queries)
+        if self.dtype == 'int8':
+            projected = projected * self.scale # масштаб переносится в запрос, коды не умножаются
+        scores = np.empty((len(projected), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), block_rows):
+            block = np.asarray(codes[start:start + block_rows]).astype(np.float32)
+            scores[:, start:start + len(block)] = projected @ block.T
+        scores += self.query_offset(queries)[:, None]
+        return scores
+
+    def save(self, path):
+        arrays = {'dtype': np.array(self.dtype), 'pca_dim': np.array(self.pca_dim or 0)}
+        for name in ('mean', 'components', 'scale'):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            codec = cls(dtype=str(data['dtype']), pca_dim=int(data['pca_dim']) or None)
+            for name in ('mean', 'components', 'scale'):
+                if name in data:
+                    setattr(codec, name, data[name])
+        codec.fitted = True
+        return codec
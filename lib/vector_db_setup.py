@@ -1,192 +1,922 @@
-import pandas as pd
-import numpy as np
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
-from langchain_community.document_loaders import DataFrameLoader, TextLoader, PDFMinerLoader
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import string
+import hashlib
+import json
 import os
 import datetime as dt
+import time
+import atexit
 import logging
+import threading
+import weakref
+import multiprocessing
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
 from tqdm import tqdm
 from pathlib import Path
 from dotenv import load_dotenv
 import yaml
 
-config = yaml.safe_load(open('./config.yaml'))
+# Тяжелые модули (chromadb, langchain, pdfminer, sentence-transformers) и модули lib, которым нужен numpy,
+# импортируются при первом использовании
+from lib.query_cache import LRUCache, QueryCache, normalize_question
+from lib.chroma_client import get_shared_chroma_client, with_retries
+from lib.bm25_index import BM25Index, reciprocal_rank_fusion
+from lib.documents import SUPPORTED_FILE_TYPES, iter_pages, iter_chunk_batches, make_text_splitter, parse_file
+from lib.metrics import SIZE_BUCKETS, metrics, log_event, profile_if_slow, start_metrics_server
+from lib.tenancy import DocumentRegistry, EvictionJob, document_filter, shared_collection_name
 
 load_dotenv()
+CONFIG_PATH = os.getenv('RAG_CONFIG', './config.yaml')
 PROJECT_DIRECTORY = os.getenv('PROJECT_DIRECTORY')
 SOURCE_DOCUMENTS_FOLDER = os.getenv('SOURCE_DOCUMENTS_FOLDER')
 
-log_name = f"{dt.datetime.now().strftime('%Y_%m_%d')}.log"
-if log_name not in os.listdir("logs/"):
-    Path(f"logs/{log_name}").touch()
-
-logging.basicConfig(
-    # filename='lll.log',
-    # filemode='a',
-    format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler(f"logs/{dt.datetime.now().strftime('%Y_%m_%d')}.log"),
-        logging.StreamHandler()
-    ],
-    level=logging.INFO
-)
-
 # EMBEDDINGS_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 # EMBEDDINGS_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 EMBEDDINGS_MODEL_NAME = "intfloat/multilingual-e5-small"
-emb_func = SentenceTransformerEmbeddings(model_name=EMBEDDINGS_MODEL_NAME) # Модель для создания эмбеддингов
 
+# Знаки препинания, кавычки-елочки и переносы строк, которые удаляются из найденных фрагментов pdf
+PDF_CLEANUP_TABLE = str.maketrans('', '', string.punctuation + "«»\n")
 
-def get_texts(
-        file_name:str,
-        collection_name:str,
-        chunk_size=300,
-        chunk_overlap=100
-    ):
+# config, кэш эмбеддингов на диске и кэш запросов создаются при первом обращении, а не при импорте
+_config = None
+_emb_cache = None
+_emb_cache_ready = False
+_query_cache = None
+_emb_func = None
+_init_lock = threading.RLock()
 
+
+def _setup_logging():
+    Path("logs").mkdir(exist_ok=True)
+    logging.basicConfig(
+        # filename='lll.log',
+        # filemode='a',
+        format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=[
+            logging.FileHandler(f"logs/{dt.datetime.now().strftime('%Y_%m_%d')}.log"),
+            logging.StreamHandler()
+        ],
+        level=logging.INFO
+    )
+
+
+def get_config():
     """
-    This function is used to prepare the data for the vector store.
-    It is used to load the dataset and split the documents into smaller chunks.
-    
-    file_name: str - full file's name
-    chunk_size: int, default=300 - the size of the chunks to split the documents into
-    chunk_overlap: int, default=100 - the overlap between the chunks
+    This function is used to get the settings from config.yaml.
+    The file is read and the logs are set up on the first call, not when the module is imported.
+
+    Returns: dict - the settings
+    """
+    global _config
+    if _config is None:
+        with _init_lock:
+            if _config is None:
+                with open(CONFIG_PATH) as f:
+                    loaded = yaml.safe_load(f)
+                _setup_logging()
+                if not loaded.get('metrics', {}).get('json_logs', True):
+                    logging.getLogger('rag.metrics').setLevel(logging.WARNING) # json-строки событий upload/query не пишутся
+                _config = loaded
+    return _config
+
+
+def get_embedding_cache():
+    """
+    This function is used to get the embedding cache on disk shared by uploads and queries.
+
+    Returns: EmbeddingCache - the cache, None if it is disabled in config.yaml
+    """
+    global _emb_cache, _emb_cache_ready
+    if not _emb_cache_ready:
+        with _init_lock:
+            if not _emb_cache_ready:
+                cache_config = get_config().get('embedding_cache', {})
+                if cache_config.get('enabled'):
+                    from lib.embedding_cache import EmbeddingCache
+
+                    _emb_cache = EmbeddingCache(
+                        path=cache_config['path'],
+                        model_name=EMBEDDINGS_MODEL_NAME,
+                        max_entries=cache_config['max_entries']
+                    )
+                    atexit.register(_emb_cache.flush)
+                _emb_cache_ready = True
+    return _emb_cache
+
+
+def get_query_cache():
+    """
+    This function is used to get the in-process cache of question embeddings and answers.
+
+    Returns: QueryCache - the cache
+    """
+    global _query_cache
+    if _query_cache is None:
+        with _init_lock:
+            if _query_cache is None:
+                cache_config = get_config().get('query_cache', {})
+                _query_cache = QueryCache(
+                    embeddings_max_entries=cache_config.get('embeddings_max_entries', 10000),
+                    results_max_entries=cache_config.get('results_max_entries', 5000)
+                )
+    return _query_cache
+
+
+def get_embedding_function():
     """
-    dataset_path = file_name
-    logging.info(f'Выбраны данные из файла: {dataset_path}')
+    This function is used to get the embedding model shared by uploads and queries.
+    It is the model in this process, or the client of lib.embedding_server if embedding_server.url is set in config.yaml.
+    The weights are loaded (or the server is connected) on first use.
 
-    if dataset_path.endswith('.txt'):
-        loader = TextLoader(dataset_path)
-    elif dataset_path.endswith('.pdf'):
-        loader = PDFMinerLoader(dataset_path)
+    Returns: EmbeddingModel - the model
+    """
+    global _emb_func
+    if _emb_func is None:
+        with _init_lock:
+            if _emb_func is None:
+                from lib.embedding_models import get_embedding_model
+
+                server_config = get_config().get('embedding_server', {})
+                _emb_func = get_embedding_model(
+                    EMBEDDINGS_MODEL_NAME,
+                    url=server_config.get('url'),
+                    timeout=server_config.get('timeout', 30),
+                    max_retries=server_config.get('max_retries', 5)
+                )
+    return _emb_func
+
+
+def _metrics_config():
+    return get_config().get('metrics', {})
+
+
+def __getattr__(name):
+    # Старые имена модуля: vector_db_setup.config, .emb_func, .emb_cache, .query_cache
+    if name == 'config':
+        return get_config()
+    if name == 'emb_func':
+        return get_embedding_function()
+    if name == 'emb_cache':
+        return get_embedding_cache()
+    if name == 'query_cache':
+        return get_query_cache()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warm_up_embeddings():
+    """
+    This function is used to load the embedding model before the first request.
     
-    documents = loader.load()  
+    Returns: dict - memory footprint of the loaded models in bytes
+    """
+    from lib.embedding_models import loaded_models
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len
-    )
+    get_embedding_function().warm_up()
+    footprint = loaded_models()
+    for name, size in footprint.items():
+        logging.info(f"Модель эмбеддингов {name}: {size / 2**20:.1f} MB")
+    return footprint
+
+
+def embed_documents(texts):
+    """
+    This function is used to embed the chunks with the shared model and the embedding cache.
+
+    texts: list - texts of the chunks
+    """
+    from lib.embedding_cache import embed_with_cache
+
+    metrics.inc('embedded_texts_total', len(texts), kind='passage')
+    with metrics.timer('embed', kind='passage'):
+        emb_func = get_embedding_function()
+        return embed_with_cache(emb_func.with_passage_prefix(texts), emb_func.encode, get_embedding_cache())
+
+
+def embed_queries(questions):
+    """
+    This function is used to embed the questions with the shared model and the embedding cache.
+
+    questions: list - the questions to embed
+    """
+    from lib.embedding_cache import embed_with_cache
+
+    metrics.inc('embedded_texts_total', len(questions), kind='query')
+    with metrics.timer('embed', kind='query'):
+        emb_func = get_embedding_function()
+        return embed_with_cache(emb_func.with_query_prefix(questions), emb_func.encode, get_embedding_cache())
+
+
+def make_chunk_ids(texts, namespace='', repeats=None):
+    """
+    This function is used to build deterministic ids of the chunks.
+    The id is a hash of the chunk's text, so an unchanged chunk keeps its id between uploads.
+    Repeated texts get the number of the repetition as a suffix.
+
+    texts: list - texts of the chunks
+    namespace: str, default='' - prefix which separates chunks of different documents in one collection
+    repeats: dict, default=None - repetition counters, pass the same dict to number repetitions across calls
+    """
+    if repeats is None:
+        repeats = {}
+    ids = []
+    for text in texts:
+        digest = hashlib.sha256(f"{namespace}\0{text}".encode('utf-8')).hexdigest()[:32]
+        n = repeats.get(digest, 0)
+        repeats[digest] = n + 1
+        ids.append(digest if n == 0 else f"{digest}-{n}")
+    return ids
+
+
+def _get_existing_ids(collection, where=None, page_size=10000, include_metadatas=False):
+    """
+    This function is used to get ids of all chunks stored in the collection.
+
+    collection: collection - the collection to read
+    where: dict, default=None - metadata filter, only ids of the matching chunks are returned
+    page_size: int, default=10000 - the number of ids requested at once
+    include_metadatas: bool, default=False - return the metadata of every id too
+
+    Returns: set - the ids, dict - id -> metadata with include_metadatas
+    """
+    ids = {}
+    offset = 0
+    while True:
+        page = with_retries(collection.get, where=where, include=['metadatas'] if include_metadatas else [], limit=page_size, offset=offset)
+        ids.update(zip(page['ids'], page['metadatas'] if include_metadatas else [None] * len(page['ids'])))
+        if len(page['ids']) < page_size:
+            return ids if include_metadatas else set(ids)
+        offset += page_size
+
+
+def _upsert_batch(collection, documents, metadatas, embeddings, ids, max_retries):
+    """
+    This function is used to upsert one batch of chunks to the collection.
+    Failed requests are retried with exponential backoff.
+
+    collection: collection - the collection to upsert the batch to
+    documents: list - texts of the chunks
+    metadatas: list - metadata of the chunks
+    embeddings: list - embeddings of the chunks
+    ids: list - ids of the chunks
+    max_retries: int - the number of attempts before the error is raised
+    """
+    with metrics.timer('ingest_upsert'):
+        with_retries(
+            collection.upsert,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=embeddings,
+            ids=ids,
+            max_retries=max_retries,
+            base_delay=1
+        )
+    metrics.inc('chunks_upserted_total', len(ids))
+    get_query_cache().bump_version(collection.name) # Новые страницы сразу доступны для поиска
+
+
+_END_OF_STREAM = object()
+
+
+def _produce(items, queue, stop):
+    """
+    This function is used to move items of a generator into a bounded queue in a background thread.
+    An exception of the generator is passed to the consumer through the queue.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    try:
+        for item in items:
+            if not put(item):
+                return
+        put(_END_OF_STREAM)
+    except Exception as e:
+        put(e)
+
+
+def _iter_queue(items, maxsize):
+    """
+    This function is used to run a generator ahead of its consumer, keeping at most maxsize items in memory.
+    """
+    queue = Queue(maxsize=maxsize)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(items, queue, stop), daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _END_OF_STREAM:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+_bm25_indexes = None # LRU загруженных индексов, остальные читаются с диска при следующем обращении
+_bm25_live = weakref.WeakValueDictionary() # индексы, которые еще используются загрузкой, даже если вытеснены из LRU
+_bm25_lock = threading.Lock()
+_lexical_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
 
-    logging.info(f"Chunk size: {chunk_size}")
-    logging.info(f"Chunk overlap: {chunk_overlap}")
 
-    # Альтернативный вариант создания чанков через токенайзер LLM
-    # text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-    #     AutoTokenizer.from_pretrained("Open-Orca/Mistral-7B-OpenOrca"),
-    #     chunk_size=chunk_size,
-    #     chunk_overlap=chunk_overlap,
-    #     separators=["\n\n", "\n", " ", ""]
-    # )
+def _bm25_key(collection_name, partition=None):
+    return collection_name if partition is None else f"{collection_name}.{hashlib.sha256(partition.encode('utf-8')).hexdigest()[:16]}"
 
-    texts = text_splitter.split_documents(documents)
 
+def _bm25_path(key):
+    return Path(get_config().get('bm25', {}).get('path', './bm25')) / f"{key}.json.gz"
+
+
+def get_bm25_index(collection_name, partition=None):
+    """
+    This function is used to get the BM25 index of the collection, it is loaded from disk on first use.
+    At most bm25.max_indexes indexes are kept in memory, the least recently used ones are loaded again when needed.
+
+    collection_name: str - the name of the collection
+    partition: str, default=None - part of a shared collection with its own index, e.g. the tenant
+    """
+    global _bm25_indexes
+    key = _bm25_key(collection_name, partition)
+    with _bm25_lock:
+        if _bm25_indexes is None:
+            _bm25_indexes = LRUCache(get_config().get('bm25', {}).get('max_indexes', 64))
+        index = _bm25_indexes.get(key)
+        if index is None:
+            # Вытесненный индекс, который еще изменяет загрузка, не перечитывается с диска, иначе ее изменения потеряются
+            index = _bm25_live.get(key)
+            if index is None:
+                index = BM25Index.load(_bm25_path(key))
+                _bm25_live[key] = index
+            _bm25_indexes.put(key, index)
+        return index
+
+
+def save_bm25_index(collection_name, partition=None):
+    """
+    This function is used to save the BM25 index of the collection next to the other indexes.
+    An empty index of a partition is removed from memory and disk.
+
+    collection_name: str - the name of the collection
+    partition: str, default=None - part of a shared collection with its own index, e.g. the tenant
+    """
+    key = _bm25_key(collection_name, partition)
+    index = get_bm25_index(collection_name, partition)
+    if partition is not None and len(index) == 0:
+        with _bm25_lock:
+            _bm25_indexes.pop(key)
+            _bm25_live.pop(key, None)
+        _bm25_path(key).unlink(missing_ok=True)
+        return
+    index.save(_bm25_path(key))
 
-    def upload_to_vectorstore(texts, collection_name):
 
-        """
-        This function is used to upload the data to the vector store.
-        It is used to upload the data to the vector store and create a collection.
+def upload_to_vectorstore(batches, collection_name, batch_size=64, max_retries=3, progress_callback=None, cancel_event=None, namespace='', where=None, client=None, partition=None, save_lexical_index=True):
+    """
+    This function is used to upload the data to the vector store.
+    It creates the collection if needed and synchronizes it with the chunks:
+    only new chunks are embedded and upserted, chunks which are gone are deleted.
+    Chunks with unchanged text keep their embeddings, their metadata (e.g. the page) is updated if it changed.
+    Batches are consumed as they arrive, so the collection is filled while the document is still being read.
 
-        texts: list - the list of texts to upload to the vector store
-        collection_name: str, default=None - the name of the collection to create in the vector store    
-        """
+    batches: iterable - batches of (text, metadata) pairs
+    collection_name: str - the name of the collection in the vector store
+    batch_size: int, default=64 - the number of ids deleted per request
+    max_retries: int, default=3 - the number of attempts to upload each batch
+    progress_callback: callable, default=None - called with the current report after every batch
+    cancel_event: threading.Event, default=None - the upload stops after the current batch when the event is set
+    namespace: str, default='' - part of the chunk ids, separates documents stored in one collection
+    where: dict, default=None - metadata filter of the document's chunks, only they are compared and deleted
+    client: client, default=None - the vector store client, the one from get_vectorstore_client() if None
+    partition: str, default=None - BM25 partition of the chunks in a shared collection, e.g. the tenant
+    save_lexical_index: bool, default=True - save the BM25 index after the upload, False if the caller saves it later
 
-        flag = True
+    Returns: dict - the number of added, deleted and unchanged chunks
+    and of the unchanged chunks with updated metadata, None if the upload failed
+    """
+    report = None
+    started = time.perf_counter()
+    flag = True
+    try:
+        embedding_function = get_embedding_function()
+        embedding_function.load()
+        logging.info("Загрузка модели для эмбеддингов: SUCCESS")
+    except Exception as e:
+        logging.exception(f"Ошибка при загрузке модели эмбеддингов: {e}")
+        flag = False
+        
+    if flag:
         try:
-            embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDINGS_MODEL_NAME)
-            logging.info("Загрузка модели для эмбеддингов: SUCCESS")
+            chroma_client = client if client is not None else get_vectorstore_client()
+            if chroma_client is None:
+                raise ConnectionError("CHROMADB недоступна")
+            logging.info("Подключение к CHROMADB: SUCCESS")
         except Exception as e:
-            logging.info("Ошибка при загрузке модели эмбеддингов:", e)
+            logging.exception(f"Ошибка при подключении к CHROMADB: {e}")
+            flag = False
+    
+    if flag:
+        try:
+            collection = chroma_client.get_or_create_collection(name=collection_name,
+                                            metadata={"hnsw:space": "cosine"},
+                                            embedding_function=embedding_function
+                                            )
+            with metrics.timer('ingest_existing_ids'):
+                existing_ids = _get_existing_ids(collection, where=where, include_metadatas=True)
+            logging.info(f"Коллекция {collection_name}: SUCCESS, чанков в коллекции: {len(existing_ids)}")
+        except Exception as e:
+            logging.exception(f"Ошибка при создании коллекции: {e}")
             flag = False
-            
-        if flag:
-            try:
-                chroma_client = chromadb.HttpClient(
-                    settings=Settings(
-                        allow_reset=config['chromadb']['server_config']['allow_reset'],
-                        chroma_api_impl=config['chromadb']['server_config']['chroma_api_impl'],
-                        chroma_server_host=config['chromadb']['server_config']['chroma_server_host'],
-                        chroma_server_http_port=config['chromadb']['server_config']['chroma_server_http_port'],
-                        anonymized_telemetry=config['chromadb']['server_config']['anonymized_telemetry']
-                        )
-                    )
-                logging.info("Подключение к CHROMADB: SUCCESS")
-            except Exception as e:
-                logging.info("Ошибка при подключении к CHROMADB:", e)
-                flag = False
-        
-        if flag:
-            for i in chroma_client.list_collections():
-                if i.name == collection_name:
-                    chroma_client.delete_collection(collection_name)
-                    logging.info(f'Была обнаружена и удалена существующая коллекция с именем "{collection_name}"')
-            try:
-                collection = chroma_client.get_or_create_collection(name=collection_name,
-                                                metadata={"hnsw:space": "cosine"},
-                                                embedding_function=embedding_function
-                                                )
-                logging.info(f"Создание коллекции {collection_name}: SUCCESS")
-            except Exception as e:
-                logging.info("Ошибка при создании коллекции:", e)
-                flag = False
-        
-        if flag:
-            try:
-                counter = 0
-                for doc in texts:
-                    counter += 1
-                    # if counter % 100 == 0:
-                    #     logging.info(f"uploaded {counter} of {len(texts)}")
-                    collection.add(
-                        documents=doc.page_content,
-                        metadatas=doc.metadata,
-                        ids=['id'+str(counter)]
-                        # ids=doc.metadata['id']
-                    )
-                logging.info("Загрузка данных в CHROMADB: SUCCESS")
-            except Exception as e:
-                logging.info("Ошибка при загрузке данных в CHROMADB:", e)
     
-    upload_to_vectorstore(
-        texts=texts,
-        collection_name=collection_name
+    if flag:
+        report = {'added': 0, 'deleted': 0, 'unchanged': 0, 'updated': 0, 'cancelled': False}
+        lexical_index = get_bm25_index(collection_name, partition)
+        seen_ids = set()
+        repeats = {}
+        # Подпись модели входит в id, поэтому при смене модели или префиксов все чанки пересчитываются
+        signature = embedding_function.signature
+        id_namespace = f"{signature}|{namespace}" if namespace else signature
+        # Эмбеддинги батча N+1 считаются, пока батч N загружается в CHROMADB
+        try:
+            with ThreadPoolExecutor(max_workers=1) as uploader, tqdm(desc=f"Загрузка в {collection_name}", unit="chunk") as progress:
+                pending = None
+                for batch in batches:
+                    if cancel_event is not None and cancel_event.is_set():
+                        report['cancelled'] = True
+                        break
+                    ids = make_chunk_ids([text for text, _ in batch], namespace=id_namespace, repeats=repeats)
+                    seen_ids.update(ids)
+                    lexical_index.add_many(ids, [text for text, _ in batch])
+                    new_chunks = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, batch) if chunk_id not in existing_ids]
+                    report['unchanged'] += len(batch) - len(new_chunks)
+                    # Текст чанка не изменился, но он мог переехать на другую страницу: обновляются только метаданные
+                    moved = [(chunk_id, metadata) for chunk_id, (_, metadata) in zip(ids, batch) if chunk_id in existing_ids and existing_ids[chunk_id] != metadata]
+                    if moved:
+                        with metrics.timer('ingest_update_metadata'):
+                            with_retries(
+                                collection.update,
+                                ids=[chunk_id for chunk_id, _ in moved],
+                                metadatas=[metadata for _, metadata in moved],
+                                max_retries=max_retries
+                            )
+                        report['updated'] += len(moved)
+                    progress.update(len(batch))
+                    if not new_chunks:
+                        if progress_callback is not None:
+                            progress_callback(dict(report))
+                        continue
+
+                    documents = [text for _, (text, _) in new_chunks]
+                    metrics.observe('embed_batch_size', len(documents), buckets=SIZE_BUCKETS)
+                    embeddings = embed_documents(documents)
+                    if pending is not None:
+                        pending.result()
+                    pending = uploader.submit(
+                        _upsert_batch,
+                        collection,
+                        documents,
+                        [metadata for _, (_, metadata) in new_chunks],
+                        embeddings,
+                        [chunk_id for chunk_id, _ in new_chunks],
+                        max_retries
+                    )
+                    report['added'] += len(new_chunks)
+                    if progress_callback is not None:
+                        progress_callback(dict(report))
+                if pending is not None:
+                    pending.result()
+
+            # После отмены документ прочитан не полностью, поэтому старые чанки не удаляются
+            removed_ids = list(existing_ids.keys() - seen_ids) if not report['cancelled'] else []
+            with metrics.timer('ingest_delete'):
+                for start in range(0, len(removed_ids), batch_size):
+                    with_retries(collection.delete, ids=removed_ids[start:start + batch_size], max_retries=max_retries)
+            report['deleted'] = len(removed_ids)
+            lexical_index.remove_many(removed_ids)
+            if save_lexical_index:
+                with metrics.timer('bm25_save'):
+                    save_bm25_index(collection_name, partition)
+            logging.info(f"Изменения в коллекции {collection_name}: {report}")
+
+            from lib.local_vectorstore import LocalCollection
+
+            if isinstance(collection, LocalCollection):
+                with metrics.timer('vectorstore_persist'):
+                    collection.persist()
+            emb_cache = get_embedding_cache()
+            if emb_cache is not None:
+                emb_cache.flush()
+                logging.info(f"Кэш эмбеддингов: {emb_cache.hits} попаданий, {emb_cache.misses} промахов")
+            logging.info("Загрузка данных в CHROMADB: SUCCESS")
+        except Exception as e:
+            logging.exception(f"Ошибка при загрузке данных в CHROMADB: {e}")
+            report = None
+        finally:
+            get_query_cache().bump_version(collection_name)
+
+    elapsed = time.perf_counter() - started
+    metrics.observe('ingest_upload_seconds', elapsed)
+    if report is None:
+        metrics.inc('uploads_total', status='failed')
+    else:
+        metrics.inc('uploads_total', status='cancelled' if report['cancelled'] else 'done')
+        for key in ('added', 'deleted', 'unchanged', 'updated'):
+            metrics.inc(f'chunks_{key}_total', report[key])
+    log_event('upload', collection=collection_name, namespace=namespace, seconds=round(elapsed, 3), report=report)
+    return report
+
+
+def _timed_pages(pages):
+    """
+    This function is used to measure reading of every page of the document (pdf parsing, decoding of txt).
+    """
+    pages = iter(pages)
+    while True:
+        started = time.perf_counter()
+        try:
+            page_number, text = next(pages)
+        except StopIteration:
+            return
+        metrics.observe('ingest_load_page_seconds', time.perf_counter() - started)
+        metrics.inc('pages_total')
+        metrics.inc('page_chars_total', len(text))
+        yield page_number, text
+
+
+class _TimedSplitter:
+    """
+    Wrapper of a text splitter which measures splitting of every page.
+    """
+
+    def __init__(self, text_splitter):
+        self.text_splitter = text_splitter
+        self.page_batch_size = getattr(text_splitter, 'page_batch_size', 1)
+
+    def split_text(self, text):
+        with metrics.timer('ingest_split_page'):
+            chunks = self.text_splitter.split_text(text)
+        metrics.inc('chunks_split_total', len(chunks))
+        return chunks
+
+    def split_texts(self, texts):
+        with metrics.timer('ingest_split_pages'):
+            page_chunks = self.text_splitter.split_texts(texts)
+        metrics.inc('chunks_split_total', sum(len(chunks) for chunks in page_chunks))
+        return page_chunks
+
+
+def _splitter_options():
+    """
+    This function is used to read the chunking section of config.yaml: the unit of chunk_size and chunk_overlap
+    and, for tokens, the tokenizer and the number of pages tokenized at once.
+
+    Returns: dict - keyword arguments of make_text_splitter besides chunk_size and chunk_overlap
+    """
+    chunking_config = get_config().get('chunking', {})
+    unit = chunking_config.get('unit', 'characters')
+    if unit != 'tokens':
+        return {'unit': unit}
+    return {
+        'unit': unit,
+        'tokenizer_name': chunking_config.get('tokenizer') or EMBEDDINGS_MODEL_NAME,
+        'page_batch_size': chunking_config.get('page_batch_size', 16)
+    }
+
+
+def _near_duplicate_filter():
+    """
+    This function is used to create the near-duplicate filter of one document from the deduplication section of config.yaml.
+
+    Returns: NearDuplicateFilter - the filter, None if the deduplication is disabled
+    """
+    dedup_config = get_config().get('deduplication', {})
+    if not dedup_config.get('enabled'):
+        return None
+    from lib.near_duplicates import NearDuplicateFilter
+
+    return NearDuplicateFilter(
+        threshold=dedup_config.get('threshold', 0.8),
+        num_perm=dedup_config.get('num_perm', 64),
+        shingle_size=dedup_config.get('shingle_size', 3)
     )
-    # return texts
+
+
+def _source_size(source):
+    if isinstance(source, (str, Path)):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    return getattr(source, 'size', None)
+
+
+def get_texts(
+        file_name,
+        collection_name:str,
+        chunk_size=300,
+        chunk_overlap=100,
+        batch_size=64,
+        max_retries=3,
+        file_type=None,
+        source_name=None,
+        queue_size=4,
+        progress_callback=None,
+        cancel_event=None,
+        client=None,
+        metadata=None,
+        namespace='',
+        where=None,
+        partition=None
+    ):
+
+    """
+    This function is used to prepare the data for the vector store.
+    The document is read page by page, split into chunks and uploaded in batches,
+    so memory doesn't depend on the size of the document.
+    
+    file_name: str, bytes or file-like object - full file's name or the file's content
+    chunk_size: int, default=300 - the size of the chunks to split the documents into
+    chunk_overlap: int, default=100 - the overlap between the chunks
+    batch_size: int, default=64 - the number of chunks embedded and uploaded per request
+    max_retries: int, default=3 - the number of attempts to upload each batch
+    file_type: str, default=None - 'pdf' or 'txt', required if file_name is not a path
+    source_name: str, default=None - name of the document saved in the metadata of the chunks
+    queue_size: int, default=4 - the number of batches parsed ahead of the upload
+    progress_callback: callable, default=None - called with the current report after every batch
+    cancel_event: threading.Event, default=None - the upload stops after the current batch when the event is set
+    client: client, default=None - the vector store client, the one from get_vectorstore_client() if None
+    metadata: dict, default=None - metadata added to every chunk besides 'source' and 'page'
+    namespace: str, default='' - part of the chunk ids, separates documents stored in one collection
+    where: dict, default=None - metadata filter of the document's chunks, only they are compared and deleted
+    partition: str, default=None - BM25 partition of the chunks in a shared collection, e.g. the tenant
+
+    Returns: dict - the number of added, deleted and unchanged chunks
+    and of the unchanged chunks with updated metadata, None if the upload failed
+    """
+    if source_name is None:
+        source_name = str(file_name) if isinstance(file_name, (str, Path)) else getattr(file_name, 'name', 'buffer')
+    logging.info(f'Выбраны данные из файла: {source_name}')
+
+    splitter_options = _splitter_options()
+    text_splitter = make_text_splitter(chunk_size, chunk_overlap, **splitter_options)
+
+    logging.info(f"Chunk size: {chunk_size} ({splitter_options['unit']})")
+    logging.info(f"Chunk overlap: {chunk_overlap}")
+
+    # Страница -> чанки -> батч разбираются в отдельном потоке, в памяти не больше queue_size батчей
+    pages = _timed_pages(iter_pages(file_name, file_type=file_type))
+    batches = iter_chunk_batches(pages, _TimedSplitter(text_splitter), {**(metadata or {}), 'source': source_name}, batch_size)
+    # Почти одинаковые чанки (колонтитулы, перекрытия) отбрасываются до эмбеддинга
+    near_duplicates = _near_duplicate_filter()
+    if near_duplicates is not None:
+        from lib.near_duplicates import iter_unique_batches
+
+        batches = iter_unique_batches(batches, near_duplicates)
+    source_size = _source_size(file_name)
+    if source_size is not None:
+        metrics.inc('source_bytes_total', source_size)
+
+    metrics_config = _metrics_config()
+    with profile_if_slow(f"get_texts_{collection_name}", metrics_config.get('profile_slow_seconds'), metrics_config.get('profile_dir', './logs/profiles')):
+        report = upload_to_vectorstore(
+            batches=_iter_queue(batches, maxsize=queue_size),
+            collection_name=collection_name,
+            batch_size=batch_size,
+            max_retries=max_retries,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
+            client=client,
+            namespace=namespace,
+            where=where,
+            partition=partition
+        )
+    if report is not None and near_duplicates is not None:
+        report['duplicates'] = near_duplicates.duplicates
+        metrics.inc('chunks_near_duplicate_total', near_duplicates.duplicates)
+        logging.info(f"Почти одинаковых чанков отброшено: {near_duplicates.duplicates}")
+    return report
 
 
 def get_chroma_client():
     """
     This function is used to get the chroma client.
-    It is used to get the chroma client to connect to the vector store.
+    The client is created once per process and shared by all sessions and uploads,
+    its connection is checked with a heartbeat and recreated if the server went away.
     
     Returns: chroma_client - the chroma client to connect to the vector store"""
+    chromadb_config = get_config()['chromadb']
+    client_config = chromadb_config.get('client', {})
     try:
-        chroma_client = chromadb.HttpClient(
-            settings=Settings(
-                allow_reset=config['chromadb']['server_config']['allow_reset'],
-                chroma_api_impl=config['chromadb']['server_config']['chroma_api_impl'],
-                chroma_server_host=config['chromadb']['server_config']['chroma_server_host'],
-                chroma_server_http_port=config['chromadb']['server_config']['chroma_server_http_port'],
-                anonymized_telemetry=config['chromadb']['server_config']['anonymized_telemetry']
-                )
-            )
-        logging.info("Подключение к CHROMADB: SUCCESS")
-        logging.info("Доступны следующие коллекции:")
-        for i in chroma_client.list_collections():
-            logging.info(f"- {i.name}")
-        return chroma_client
+        return get_shared_chroma_client(
+            chromadb_config['server_config'],
+            timeout=client_config.get('timeout'),
+            heartbeat_interval=client_config.get('heartbeat_interval', 30),
+            max_retries=client_config.get('max_retries', 3)
+        )
     except Exception as e:
-        logging.info("Ошибка при подключении к CHROMADB:", e)
+        logging.exception(f"Ошибка при подключении к CHROMADB: {e}")
         return None
 
-def vectorstore_query(collection, source_file_type, question, n_results):
+_local_client = None
+_local_client_lock = threading.Lock()
+
+
+def get_vectorstore_client():
+    """
+    This function is used to get the client of the vector store selected in config.yaml.
+    'chroma' is the chromadb server, 'local' is the in-process store from lib.local_vectorstore
+    which has the same interface and keeps collections on disk without a server.
+
+    Returns: client - the client to connect to the vector store
+    """
+    global _local_client
+    vectorstore_config = get_config().get('vectorstore', {})
+    if vectorstore_config.get('backend', 'chroma') != 'local':
+        return get_chroma_client()
+    with _local_client_lock:
+        if _local_client is None:
+            from lib.local_vectorstore import LocalClient
+
+            compact = vectorstore_config['local'].get('compact') or {}
+            _local_client = LocalClient(
+                path=vectorstore_config['local']['path'],
+                hnsw_threshold=vectorstore_config['local']['hnsw_threshold'],
+                compact={f"vectors:{key}": value for key, value in compact.items() if value is not None}
+            )
+            atexit.register(_local_client.persist)
+            logging.info(f"Локальное хранилище векторов: {vectorstore_config['local']['path']}")
+        return _local_client
+
+def _format_response(documents, source_file_type):
+    """
+    This function is used to join the found chunks into the text of the answer.
+
+    documents: list - the found chunks of one question
+    source_file_type: str - type of file which was used for collection creating
+    """
+    if source_file_type.lower() in ['txt']:
+        vector_db_response = " ".join(documents)
+    
+    elif source_file_type.lower() in ['pdf']:
+        vector_db_response = "".join(doc.translate(PDF_CLEANUP_TABLE).capitalize() + ". " for doc in documents)
+
+    return vector_db_response
+
+
+def vectorstore_query_batch(collection, source_file_type, questions, n_results, batch_size=256, mode='vector', latency_budget_ms=None, where=None, partition=None):
+    """
+    This function is used to query the vector store with many questions at once.
+    Questions which are not cached are embedded in one forward pass of the model
+    and sent to the collection in one request per batch_size questions.
+
+    In 'hybrid' mode the BM25 index of the collection is searched in parallel with the vector search
+    and both rankings are fused with reciprocal rank fusion, so exact terms (part numbers, names) are found too.
+    If the lexical search doesn't finish within latency_budget_ms, the vector results are returned alone.
+
+    In a shared collection where limits the search to the chunks of one tenant or document,
+    and partition selects the BM25 index of the tenant.
+    
+    collection: collection - the collection to query in the vector store
+    source_file_type: str - type of file which was used for collection creating
+    questions: list - the questions to query in the vector store
+    n_results: int - the number of results to return for every question
+    batch_size: int, default=256 - the maximum number of questions in one request to the collection
+    mode: str, default='vector' - 'vector' or 'hybrid'
+    latency_budget_ms: float, default=None - time limit of the hybrid query, no limit if None
+    where: dict, default=None - metadata filter of the chunks
+    partition: str, default=None - BM25 partition of a shared collection, e.g. the tenant
+
+    Returns: list - the answer for every question, in the order of the questions
+    """
+    started = time.perf_counter()
+    metrics_config = _metrics_config()
+    with profile_if_slow(f"query_{collection.name}", metrics_config.get('profile_slow_seconds'), metrics_config.get('profile_dir', './logs/profiles')):
+        responses, stats = _query_batch(collection, source_file_type, questions, n_results, batch_size, mode, latency_budget_ms, where, partition, started)
+    elapsed = time.perf_counter() - started
+    metrics.observe('query_seconds', elapsed, mode=mode)
+    metrics.observe('query_batch_size', len(questions), buckets=SIZE_BUCKETS)
+    metrics.inc('questions_total', len(questions), mode=mode)
+    log_event('query', collection=collection.name, mode=mode, questions=len(questions), n_results=n_results, seconds=round(elapsed, 4), **stats)
+    return responses
+
+
+def _query_batch(collection, source_file_type, questions, n_results, batch_size, mode, latency_budget_ms, where, partition, started):
+    """
+    This function is used to run vectorstore_query_batch, it returns the answers and the counters of the query.
+    """
+    query_cache = get_query_cache()
+    stats = {'cache_hits': 0, 'degraded': False}
+    responses = [None] * len(questions)
+    pending = {} # ключ кэша -> индексы вопросов с этим ключом
+    where_key = json.dumps(where, sort_keys=True) if where else None
+    for i, question in enumerate(questions):
+        result_key = query_cache.result_key(collection, question, n_results, source_file_type.lower(), mode, where_key)
+        vector_db_response = query_cache.results.get(result_key)
+        if vector_db_response is not None:
+            responses[i] = vector_db_response
+            stats['cache_hits'] += 1
+        else:
+            pending.setdefault(result_key, []).append(i)
+    metrics.inc('query_result_cache_hits_total', stats['cache_hits'])
+    metrics.inc('query_result_cache_misses_total', len(questions) - stats['cache_hits'])
+    if not pending:
+        return responses, stats
+
+    result_keys = list(pending)
+    # Нормализованный текст - только ключ кэша, модель получает вопрос в том виде, в каком его ввели
+    original_questions = [questions[pending[key][0]] for key in result_keys]
+    normalized_questions = [normalize_question(question) for question in original_questions]
+
+    lexical_index = get_bm25_index(collection.name, partition) if mode == 'hybrid' else None
+    hybrid = lexical_index is not None and len(lexical_index) > 0
+    dedup_config = get_config().get('deduplication', {})
+    query_threshold = dedup_config.get('query_threshold') if dedup_config.get('enabled') else None
+    # С дедупликацией берется в 2 раза больше кандидатов, чтобы после удаления повторов осталось n_results
+    window = n_results * 2 if query_threshold is not None else n_results
+    depth = max(n_results * 4, 20) if hybrid else window
+    if hybrid:
+        lexical_future = _lexical_executor.submit(lambda: [lexical_index.search(question, depth) for question in normalized_questions])
+
+    query_embeddings = [query_cache.embeddings.get(question) for question in normalized_questions]
+    missing = [i for i, embedding in enumerate(query_embeddings) if embedding is None]
+    metrics.inc('query_embedding_cache_hits_total', len(query_embeddings) - len(missing))
+    stats['embedded'] = len(missing)
+    if missing:
+        for i, embedding in zip(missing, embed_queries([original_questions[i] for i in missing])):
+            query_embeddings[i] = embedding
+            query_cache.embeddings.put(normalized_questions[i], embedding)
+
+    rankings = []
+    documents_by_id = {}
+    for start in range(0, len(result_keys), batch_size):
+        with metrics.timer('query_vector_search'):
+            response = with_retries(
+                collection.query,
+                query_embeddings=query_embeddings[start:start + batch_size], # Векторный поиск происходит через эмбеддинг, который создается той же моделью, что и в chromadb
+                n_results=depth,
+                **({'where': where} if where else {})
+            )
+        for ids, documents in zip(response['ids'], response['documents']):
+            rankings.append(ids)
+            documents_by_id.update(zip(ids, documents))
+
+    degraded = False
+    if hybrid:
+        timeout = None
+        if latency_budget_ms is not None:
+            timeout = max(0.0, latency_budget_ms / 1000 - (time.perf_counter() - started))
+        try:
+            # Время ожидания BM25 сверх векторного поиска, сам поиск идет параллельно
+            with metrics.timer('query_lexical_wait'):
+                lexical_rankings = lexical_future.result(timeout=timeout)
+            if where:
+                # Индекс BM25 общий для всех документов раздела, чужие чанки отсекаются тем же фильтром
+                lexical_ids = list({chunk_id for hits in lexical_rankings for chunk_id, _ in hits})
+                with metrics.timer('query_lexical_filter'):
+                    allowed = set(with_retries(collection.get, ids=lexical_ids, where=where, include=[])['ids']) if lexical_ids else set()
+                lexical_rankings = [[(chunk_id, score) for chunk_id, score in hits if chunk_id in allowed] for hits in lexical_rankings]
+            rankings = [
+                reciprocal_rank_fusion([vector_ids, [chunk_id for chunk_id, _ in lexical_hits]])
+                for vector_ids, lexical_hits in zip(rankings, lexical_rankings)
+            ]
+        except TimeoutError:
+            logging.warning(f"BM25 поиск не уложился в {latency_budget_ms} мс, используется только векторный поиск")
+            degraded = True
+            metrics.inc('query_degraded_total')
+    stats['degraded'] = degraded
+    rankings = [ranking[:window] for ranking in rankings]
+
+    # Чанки, найденные только BM25, догружаются одним запросом
+    lexical_only = list({chunk_id for ranking in rankings for chunk_id in ranking if chunk_id not in documents_by_id})
+    if lexical_only:
+        with metrics.timer('query_fetch_lexical_only'):
+            found = with_retries(collection.get, ids=lexical_only, include=['documents'])
+        documents_by_id.update(zip(found['ids'], found['documents']))
+
+    for result_key, ranking in zip(result_keys, rankings):
+        documents = [documents_by_id[chunk_id] for chunk_id in ranking if chunk_id in documents_by_id]
+        if query_threshold is not None:
+            from lib.near_duplicates import drop_near_duplicates
+
+            documents = drop_near_duplicates(documents, threshold=query_threshold, shingle_size=dedup_config.get('shingle_size', 3))
+        documents = documents[:n_results]
+        vector_db_response = _format_response(documents, source_file_type)
+        if not degraded:
+            query_cache.results.put(result_key, vector_db_response)
+        for i in pending[result_key]:
+            responses[i] = vector_db_response
+
+    return responses, stats
+
+
+def vectorstore_query(collection, source_file_type, question, n_results, mode='vector', latency_budget_ms=None, where=None, partition=None):
     """
     This function is used to query the vector store.
     It is used to query the vector store to get the response to a question.
@@ -195,23 +925,449 @@ def vectorstore_query(collection, source_file_type, question, n_results):
     source_file_type: str - type of file which was used for collection creating
     question: str - the question to query in the vector store
     n_results: int - the number of results to return
+    mode: str, default='vector' - 'vector' or 'hybrid' (BM25 + vector search)
+    latency_budget_ms: float, default=None - time limit of the hybrid query, no limit if None
+    where: dict, default=None - metadata filter of the chunks
+    partition: str, default=None - BM25 partition of a shared collection, e.g. the tenant
     """
+    return vectorstore_query_batch(
+        collection, source_file_type, [question], n_results,
+        mode=mode, latency_budget_ms=latency_budget_ms, where=where, partition=partition
+    )[0]
 
-    response = collection.query(
-        query_embeddings=emb_func.embed_query(question), # Векторный поиск происходит через эмбеддинг, который создается той же моделью, что и в chromadb
-        # query_texts=question,
-        n_results=n_results
-    )
-        
-    if source_file_type.lower() in ['txt']:
-        vector_db_response = " ".join(response["documents"][0])
+
+def query_cache_stats():
+    """
+    This function is used to get hit/miss counters of the query caches.
+
+    Returns: dict - counters of the query embedding, query result and on-disk embedding caches
+    """
+    stats = get_query_cache().stats()
+    emb_cache = get_embedding_cache()
+    if emb_cache is not None:
+        stats['embedding_cache'] = {'entries': len(emb_cache), 'hits': emb_cache.hits, 'misses': emb_cache.misses}
+    return stats
+
+
+def _cache_gauges():
+    # Счетчики кэшей экспортируются в /metrics как gauge: query_cache_results_hits и т.п.
+    return {
+        f"cache_{cache_name}_{key}": value
+        for cache_name, cache_stats in query_cache_stats().items()
+        if isinstance(cache_stats, dict)
+        for key, value in cache_stats.items()
+        if isinstance(value, (int, float))
+    }
+
+metrics.add_collector(_cache_gauges)
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def serve_metrics():
+    """
+    This function is used to start the http server of the metrics on the port from config.yaml.
+    /metrics returns the Prometheus text format, /metrics.json the same metrics as json.
+    The server is started once per process, nothing is started if the port is not set.
+
+    Returns: server - the running server, None if the metrics server is disabled
+    """
+    global _metrics_server
+    metrics_config = _metrics_config()
+    port = metrics_config.get('port')
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            try:
+                _metrics_server = start_metrics_server(port, host=metrics_config.get('host', '127.0.0.1'))
+            except OSError as e:
+                logging.error(f"Ошибка при запуске сервера метрик на порту {port}: {e}")
+        return _metrics_server
+
+
+def _load_manifest(manifest_path):
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def _manifest_parameters(chunk_size, chunk_overlap, splitter_options):
+    """
+    Returns: dict - everything which changes the chunks of a file besides its content,
+    a manifest made with other parameters doesn't let ingest_folder skip any file
+    """
+    dedup_config = get_config().get('deduplication', {})
+    return {
+        'chunk_size': chunk_size,
+        'chunk_overlap': chunk_overlap,
+        **splitter_options,
+        'deduplication': {key: dedup_config.get(key) for key in ('threshold', 'num_perm', 'shingle_size')} if dedup_config.get('enabled') else None,
+        'embeddings': get_embedding_function().signature
+    }
+
+
+def _unique_chunk_batches(chunks, batch_size):
+    batches = (chunks[start:start + batch_size] for start in range(0, len(chunks), batch_size))
+    near_duplicates = _near_duplicate_filter()
+    if near_duplicates is None:
+        return batches
+    from lib.near_duplicates import iter_unique_batches
+
+    return iter_unique_batches(batches, near_duplicates)
+
+
+def ingest_folder(
+        collection_name:str,
+        folder=SOURCE_DOCUMENTS_FOLDER,
+        chunk_size=300,
+        chunk_overlap=100,
+        batch_size=64,
+        max_retries=3,
+        workers=None,
+        manifest_path=None,
+        client=None
+    ):
+
+    """
+    This function is used to upload all .txt and .pdf files of a folder into one collection.
+    Files are parsed and split in a process pool, the chunks are embedded and uploaded by this process only,
+    so the model is loaded once. Every document is synchronized separately, its chunks are found by the 'source' metadata.
+
+    A manifest with (path, mtime, size, sha256) of every uploaded file and the chunking parameters is kept
+    in ingest_folder.state_dir, so a repeated or interrupted run skips the files which didn't change,
+    unless the chunking parameters or the embedding model changed.
+    The BM25 index and the manifest are saved together every ingest_folder.checkpoint_files uploaded files and at the end.
+    Chunks of the files removed from the folder are deleted from the collection.
     
-    elif source_file_type.lower() in ['pdf']:
-        vector_db_response = ''
-        for doc in response['documents'][0]:
-            for i in doc:
-                if i in string.punctuation or i in "«»": 
-                    doc = doc.replace(i, '').replace("\n","")
-            vector_db_response += doc.capitalize() + ". "
+    collection_name: str - the name of the collection in the vector store
+    folder: str, default=SOURCE_DOCUMENTS_FOLDER - the folder with the documents
+    chunk_size: int, default=300 - the size of the chunks to split the documents into
+    chunk_overlap: int, default=100 - the overlap between the chunks
+    batch_size: int, default=64 - the number of chunks embedded and uploaded per request
+    max_retries: int, default=3 - the number of attempts to upload each batch
+    workers: int, default=None - the number of parsing processes, the number of CPUs if None
+    manifest_path: str, default=None - path of the manifest, a file of the folder in ingest_folder.state_dir if None
+    client: client, default=None - the vector store client, the one from get_vectorstore_client() if None
 
-    return vector_db_response
+    Returns: dict - counters of processed files and chunks
+    """
+    if folder is None:
+        raise ValueError("Папка с документами не задана: передайте folder или SOURCE_DOCUMENTS_FOLDER в .env")
+    folder = Path(folder)
+    folder_config = get_config().get('ingest_folder', {})
+    if manifest_path is None:
+        # Манифест не пишется в папку с документами: она может быть только для чтения или общей
+        folder_key = hashlib.sha256(str(folder.resolve()).encode('utf-8')).hexdigest()[:16]
+        manifest_path = Path(folder_config.get('state_dir', './ingest_state')) / f"{folder.name}_{folder_key}.json"
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    checkpoint_files = folder_config.get('checkpoint_files', 20)
+    splitter_options = _splitter_options()
+    parameters = _manifest_parameters(chunk_size, chunk_overlap, splitter_options)
+    manifest = _load_manifest(manifest_path)
+    if manifest.get(collection_name, {}).get('parameters') != parameters:
+        # Файлы, загруженные с другими параметрами, разбираются заново, их старые чанки заменяются.
+        # Имена файлов остаются, чтобы чанки удаленных из папки файлов тоже были удалены
+        old_files = manifest.get(collection_name, {}).get('files', {})
+        manifest[collection_name] = {
+            'parameters': parameters,
+            'files': {source_name: {'mtime': None, 'size': None, 'sha256': None} for source_name in old_files}
+        }
+    entries = manifest[collection_name]['files']
+    # Ссылка держит индекс в памяти до последнего checkpoint(): вытесненный из LRU индекс
+    # иначе собрался бы сборщиком мусора и перечитался с диска без загруженных после сохранения файлов
+    lexical_index = get_bm25_index(collection_name)
+    logging.info(f"Загрузка папки {folder} в коллекцию {collection_name}")
+
+    report = {'files_uploaded': 0, 'files_unchanged': 0, 'files_removed': 0, 'files_failed': 0, 'chunks_added': 0, 'chunks_deleted': 0}
+    files = {}
+    to_parse = []
+    for path in sorted(folder.rglob('*')):
+        if not path.is_file() or path.suffix.lower().lstrip('.') not in SUPPORTED_FILE_TYPES:
+            continue
+        source_name = path.relative_to(folder).as_posix()
+        stat = path.stat()
+        files[source_name] = path
+        entry = entries.get(source_name)
+        if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            report['files_unchanged'] += 1
+        else:
+            to_parse.append((path, source_name, stat, entry))
+
+    # Процессы запускаются через spawn: им нужен только lib.documents, без модели и клиентов
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    window = 2 * (workers or os.cpu_count() or 1) # не больше window разобранных файлов ждут загрузки
+    waiting = iter(to_parse)
+    futures = {}
+    uploaded_since_checkpoint = 0
+
+    def checkpoint():
+        # Манифест сохраняется только вместе с BM25, чтобы пропущенные при повторном запуске файлы были в индексе
+        nonlocal uploaded_since_checkpoint
+        with metrics.timer('bm25_save'):
+            save_bm25_index(collection_name)
+        _save_manifest(manifest_path, manifest)
+        uploaded_since_checkpoint = 0
+
+    def submit_next():
+        item = next(waiting, None)
+        if item is not None:
+            path, source_name, _, entry = item
+            known_sha256 = entry['sha256'] if entry is not None else None
+            futures[pool.submit(parse_file, str(path), source_name, chunk_size, chunk_overlap, known_sha256, splitter_options)] = item
+
+    with pool:
+        for _ in range(window):
+            submit_next()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, source_name, stat, _ = futures.pop(future)
+                submit_next()
+                try:
+                    sha256, chunks = future.result()
+                except Exception as e:
+                    logging.error(f"Ошибка при разборе файла {path}: {e}")
+                    report['files_failed'] += 1
+                    continue
+
+                if chunks is None:
+                    report['files_unchanged'] += 1
+                else:
+                    file_report = upload_to_vectorstore(
+                        batches=_unique_chunk_batches(chunks, batch_size),
+                        collection_name=collection_name,
+                        batch_size=batch_size,
+                        max_retries=max_retries,
+                        namespace=source_name,
+                        where={'source': source_name},
+                        client=client,
+                        save_lexical_index=False
+                    )
+                    if file_report is None:
+                        report['files_failed'] += 1
+                        continue
+                    report['files_uploaded'] += 1
+                    report['chunks_added'] += file_report['added']
+                    report['chunks_deleted'] += file_report['deleted']
+                    uploaded_since_checkpoint += 1
+
+                entries[source_name] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': sha256}
+                if uploaded_since_checkpoint >= checkpoint_files:
+                    checkpoint()
+
+    for source_name in sorted(set(entries) - set(files)):
+        # Пустой документ: все его чанки в коллекции считаются удаленными
+        file_report = upload_to_vectorstore(
+            batches=[],
+            collection_name=collection_name,
+            batch_size=batch_size,
+            max_retries=max_retries,
+            namespace=source_name,
+            where={'source': source_name},
+            client=client,
+            save_lexical_index=False
+        )
+        if file_report is None:
+            report['files_failed'] += 1
+            continue
+        report['files_removed'] += 1
+        report['chunks_deleted'] += file_report['deleted']
+        del entries[source_name]
+
+    checkpoint()
+    logging.info(f"Загрузка папки {folder} завершена: {report}")
+    return report
+
+
+_registry = None
+_eviction_job = None
+
+
+def _tenancy_config():
+    return get_config().get('tenancy', {})
+
+
+def get_document_registry():
+    """
+    This function is used to get the registry of the documents stored in the shared collections.
+
+    Returns: DocumentRegistry - the registry from the path in config.yaml
+    """
+    global _registry
+    if _registry is None:
+        with _init_lock:
+            if _registry is None:
+                tenancy_config = _tenancy_config()
+                _registry = DocumentRegistry(
+                    path=tenancy_config.get('registry_path', './tenancy/documents.sqlite'),
+                    touch_interval=tenancy_config.get('touch_interval', 60)
+                )
+    return _registry
+
+
+def tenant_collection_name(tenant):
+    """
+    This function is used to get the shared collection which stores the documents of the tenant.
+
+    tenant: str - the tenant (user) id
+    """
+    tenancy_config = _tenancy_config()
+    return shared_collection_name(tenant, tenancy_config.get('shards', 4), tenancy_config.get('prefix', 'shared'))
+
+
+def upload_document(
+        tenant,
+        document,
+        file_name,
+        file_type=None,
+        chunk_size=300,
+        chunk_overlap=100,
+        batch_size=64,
+        max_retries=3,
+        progress_callback=None,
+        cancel_event=None,
+        client=None
+    ):
+
+    """
+    This function is used to upload a document of the tenant into its shared collection.
+    The chunks get 'tenant' and 'document' metadata, the tenant has its own BM25 index,
+    and the document is registered for TTL and quota eviction.
+
+    tenant: str - the tenant (user) id
+    document: str - the document id, unique within the tenant
+    file_name: str, bytes or file-like object - full file's name or the file's content
+    file_type: str, default=None - 'pdf' or 'txt', required if file_name is not a path
+    chunk_size: int, default=300 - the size of the chunks to split the documents into
+    chunk_overlap: int, default=100 - the overlap between the chunks
+    batch_size: int, default=64 - the number of chunks embedded and uploaded per request
+    max_retries: int, default=3 - the number of attempts to upload each batch
+    progress_callback: callable, default=None - called with the current report after every batch
+    cancel_event: threading.Event, default=None - the upload stops after the current batch when the event is set
+    client: client, default=None - the vector store client, the one from get_vectorstore_client() if None
+
+    Returns: dict - the number of added, deleted and unchanged chunks
+    and of the unchanged chunks with updated metadata, None if the upload failed
+    """
+    collection_name = tenant_collection_name(tenant)
+    report = get_texts(
+        file_name,
+        collection_name=collection_name,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        batch_size=batch_size,
+        max_retries=max_retries,
+        file_type=file_type,
+        source_name=document,
+        progress_callback=progress_callback,
+        cancel_event=cancel_event,
+        client=client,
+        metadata={'tenant': tenant, 'document': document},
+        namespace=f"{tenant}/{document}",
+        where=document_filter(tenant, document),
+        partition=tenant
+    )
+    # Документ регистрируется и после отмены или ошибки: загруженная часть чанков тоже удаляется по TTL
+    chunks = report['added'] + report['unchanged'] if report is not None else 0
+    get_document_registry().register(tenant, document, collection_name, chunks)
+    return report
+
+
+def query_document(tenant, question, n_results, document=None, source_file_type='pdf', mode='vector', latency_budget_ms=None, client=None):
+    """
+    This function is used to answer a question from the documents of the tenant in its shared collection.
+
+    tenant: str - the tenant (user) id
+    question: str - the question to query in the vector store
+    n_results: int - the number of results to return
+    document: str, default=None - search only this document, all documents of the tenant if None
+    source_file_type: str, default='pdf' - type of the uploaded files
+    mode: str, default='vector' - 'vector' or 'hybrid' (BM25 + vector search)
+    latency_budget_ms: float, default=None - time limit of the hybrid query, no limit if None
+    client: client, default=None - the vector store client, the one from get_vectorstore_client() if None
+    """
+    chroma_client = client if client is not None else get_vectorstore_client()
+    response = vectorstore_query(
+        chroma_client.get_collection(tenant_collection_name(tenant)),
+        source_file_type,
+        question,
+        n_results,
+        mode=mode,
+        latency_budget_ms=latency_budget_ms,
+        where=document_filter(tenant, document),
+        partition=tenant
+    )
+    if document is not None:
+        get_document_registry().touch(tenant, document)
+    return response
+
+
+def delete_document(tenant, document, collection_name=None, batch_size=1000, max_retries=3, client=None):
+    """
+    This function is used to delete all chunks of a document from its shared collection and from the registry.
+
+    tenant: str - the tenant (user) id
+    document: str - the document id
+    collection_name: str, default=None - the shared collection, tenant_collection_name(tenant) if None
+    batch_size: int, default=1000 - the number of ids deleted per request
+    max_retries: int, default=3 - the number of attempts of every request
+    client: client, default=None - the vector store client, the one from get_vectorstore_client() if None
+
+    Returns: int - the number of deleted chunks
+    """
+    collection_name = collection_name or tenant_collection_name(tenant)
+    chroma_client = client if client is not None else get_vectorstore_client()
+    collection = chroma_client.get_or_create_collection(name=collection_name, metadata={"hnsw:space": "cosine"})
+    ids = list(_get_existing_ids(collection, where=document_filter(tenant, document)))
+    for start in range(0, len(ids), batch_size):
+        with_retries(collection.delete, ids=ids[start:start + batch_size], max_retries=max_retries)
+    get_bm25_index(collection_name, tenant).remove_many(ids)
+    save_bm25_index(collection_name, tenant)
+    from lib.local_vectorstore import LocalCollection
+
+    if isinstance(collection, LocalCollection):
+        collection.persist()
+    get_query_cache().bump_version(collection_name)
+    get_document_registry().remove(tenant, document)
+    metrics.inc('documents_deleted_total')
+    logging.info(f"Документ {document} пользователя {tenant} удален из {collection_name}: {len(ids)} чанков")
+    return len(ids)
+
+
+def start_eviction():
+    """
+    This function is used to start the background deletion of documents idle past the TTL
+    or beyond the quota of their tenant, with the settings of the tenancy section of config.yaml.
+    The job is started once per process.
+
+    Returns: EvictionJob - the running job, None if tenancy is disabled or neither TTL nor quotas are set
+    """
+    global _eviction_job
+    tenancy_config = _tenancy_config()
+    if not tenancy_config.get('enabled'):
+        return None
+    if not any(tenancy_config.get(key) for key in ('ttl_days', 'max_documents', 'max_chunks')):
+        return None
+    with _init_lock:
+        if _eviction_job is None:
+            ttl_days = tenancy_config.get('ttl_days')
+            _eviction_job = EvictionJob(
+                get_document_registry(),
+                evict=lambda tenant, document, collection_name: delete_document(tenant, document, collection_name),
+                ttl_seconds=ttl_days * 86400 if ttl_days else None,
+                max_documents=tenancy_config.get('max_documents'),
+                max_chunks=tenancy_config.get('max_chunks'),
+                interval=tenancy_config.get('eviction_interval', 600)
+            ).start()
+        return _eviction_job
@@ -1,5 +1,4 @@
 import sys
-import os
 sys.path.append("..")
 
 import streamlit as st
@@ -9,10 +8,51 @@ import datetime as dt
 import time
 runtime.exists()
 
-from lib.vector_db_setup import get_texts, get_chroma_client, vectorstore_query
+from lib.vector_db_setup import config, get_texts, get_vectorstore_client, query_document, serve_metrics, start_eviction, upload_document, vectorstore_query, warm_up_embeddings
+from lib.ingestion_jobs import IngestionJobQueue, QUEUED, RUNNING, DONE, CANCELLED
 
 assistant_avatar = "./icons/assistant_icon.jpg"
-chroma_client = get_chroma_client()
+chroma_client = get_vectorstore_client()
+
+
+@st.cache_resource(show_spinner=False)
+def load_embedding_model():
+    # Модель загружается один раз на процесс, а не при первой загрузке файла
+    return warm_up_embeddings()
+
+load_embedding_model()
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics_server():
+    # Один сервер метрик на процесс, а не на каждый перезапуск скрипта
+    return serve_metrics()
+
+get_metrics_server()
+
+tenancy = config.get('tenancy', {}).get('enabled', False) # Загрузки в общих коллекциях вместо коллекции на каждый файл
+
+
+@st.cache_resource(show_spinner=False)
+def get_eviction_job():
+    # Удаление документов по TTL и квотам запускается один раз на процесс
+    return start_eviction()
+
+get_eviction_job()
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    # Очередь загрузок общая для всех сессий, загрузка не блокирует поток скрипта
+    return IngestionJobQueue(
+        target=upload_document if tenancy else get_texts,
+        jobs_dir=config['ingestion_jobs']['jobs_dir'],
+        workers=config['ingestion_jobs']['workers'],
+        max_finished_jobs=config['ingestion_jobs'].get('max_finished_jobs', 1000),
+        max_age_days=config['ingestion_jobs'].get('max_age_days', 7)
+    )
+
+job_queue = get_job_queue()
 
 
 ### STREAMLIT APP ###
@@ -39,28 +79,57 @@ if 'uploaded_file_name' not in st.session_state:
     st.session_state.uploaded_file_name = ""
 if 'start_chat' not in st.session_state:
     st.session_state.start_chat = False
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
 
 uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
 if uploaded_file and st.session_state.uploaded_file_name == "": # check the file
     st.session_state.uploaded_file_name = f"{name}_{dt.datetime.now().strftime('%Y-%m-%d')}.pdf"
-    with open(f'upload/{st.session_state.uploaded_file_name}', 'wb') as f: # save the file
-        f.write(uploaded_file.getbuffer())
         
     ### UPLOAD FILE TO CHROMA ###
-    try:
-        with st.spinner('Preprocessing your data⏳'):
-            get_texts(
-                file_name = f'upload/{st.session_state.uploaded_file_name}',
-                collection_name = f'{name}_{st.session_state.uploaded_file_name}'
-            )
-        st.write("File successfully uploaded")
+    if tenancy:
+        st.session_state.job_id = job_queue.submit(
+            owner = name,
+            tenant = name,
+            document = st.session_state.uploaded_file_name,
+            file_name = uploaded_file.getvalue(),
+            file_type = 'pdf'
+        )
+    else:
+        st.session_state.job_id = job_queue.submit(
+            owner = name,
+            file_name = uploaded_file.getvalue(), # Файл читается из памяти, без сохранения на диск
+            collection_name = f'{name}_{st.session_state.uploaded_file_name}',
+            file_type = 'pdf',
+            source_name = st.session_state.uploaded_file_name
+        )
+
+
+@st.fragment(run_every=1)
+def show_upload_progress():
+    status = job_queue.status(st.session_state.job_id)
+    if status is None:
+        return
+    if status['state'] == QUEUED:
+        st.write("Your file is waiting in the queue⏳")
+    elif status['state'] == RUNNING:
+        st.write(f"Preprocessing your data⏳ {status['chunks_processed']} chunks processed ({status['chunks_per_second']} chunks/s)")
+    if status['state'] in (QUEUED, RUNNING):
+        if st.button("Cancel upload"):
+            job_queue.cancel(st.session_state.job_id)
+    elif status['state'] == DONE:
         st.session_state.file_uploaded = True
         st.session_state.start_chat = True
-    except:
+        st.rerun()
+    elif status['state'] == CANCELLED:
+        st.write("File uploading was cancelled.")
+    else:
         st.write("Something went wrong while file uploading. Please try again later.")
-    finally:
-        os.remove(f"upload/{st.session_state.uploaded_file_name}")
 
+if st.session_state.job_id is not None and not st.session_state.start_chat:
+    show_upload_progress()
+elif st.session_state.start_chat:
+    st.write("File successfully uploaded")
 
 
 
@@ -97,12 +166,26 @@ def main():
             # Response
             with st.chat_message(name="assistant", avatar=assistant_avatar):
                 with st.spinner('Generating response...⏳'):
-                    chroma_response = vectorstore_query(
-                        collection=chroma_client.get_collection(f'{name}_{st.session_state.uploaded_file_name}'),
-                        source_file_type='pdf',
-                        question=user_question,
-                        n_results=2
-                    )
+                    if tenancy:
+                        chroma_response = query_document(
+                            tenant=name,
+                            question=user_question,
+                            n_results=2,
+                            document=st.session_state.uploaded_file_name,
+                            source_file_type='pdf',
+                            mode=config['chromadb'].get('query_mode', 'vector'),
+                            latency_budget_ms=config['chromadb'].get('latency_budget_ms'),
+                            client=chroma_client
+                        )
+                    else:
+                        chroma_response = vectorstore_query(
+                            collection=chroma_client.get_collection(f'{name}_{st.session_state.uploaded_file_name}'),
+                            source_file_type='pdf',
+                            question=user_question,
+                            n_results=2,
+                            mode=config['chromadb'].get('query_mode', 'vector'),
+                            latency_budget_ms=config['chromadb'].get('latency_budget_ms')
+                        )
                     st.write(chroma_response)
             st.session_state.messages.append({"role": "assistant", "content": chroma_response, "avatar": assistant_avatar})
 
@@ -0,0 +1,31 @@
+from lib import vector_db_setup
+
+
+class FakeCollection:
+    name = 'parts'
+    id = 'parts-id'
+
+    def query(self, query_embeddings, n_results, **kwargs):
+        return {
+            'ids': [['chunk-1'] for _ in query_embeddings],
+            'documents': [['part catalogue'] for _ in query_embeddings]
+        }
+
+
+def test_questions_differing_in_case_are_embedded_separately(monkeypatch):
+    embedded = []
+
+    def fake_embed_queries(questions):
+        embedded.extend(questions)
+        return [[float(len(question))] for question in questions]
+
+    monkeypatch.setattr(vector_db_setup, '_config', {})
+    monkeypatch.setattr(vector_db_setup, '_query_cache', None)
+    monkeypatch.setattr(vector_db_setup, 'embed_queries', fake_embed_queries)
+
+    collection = FakeCollection()
+    vector_db_setup.vectorstore_query(collection, 'txt', 'XK-1234', n_results=1)
+    vector_db_setup.vectorstore_query(collection, 'txt', 'xk-1234', n_results=1)
+    vector_db_setup.vectorstore_query(collection, 'txt', 'XK-1234?', n_results=1)
+
+    assert embedded == ['XK-1234', 'xk-1234']